@@ -4,3 +4,17 @@ from acacia import models
 
 admin.site.register(models.Topic)
 
+
+class CollatedTopicAdmin(admin.ModelAdmin):
+    """
+    Admin options for CollatedTopic subclasses. Topics are listed in sort key
+    order, and sorting on the name column also uses the sort key, so that
+    both follow the configured collation and are served from its index.
+    """
+    list_display = ["topic_name", "parent"]
+    ordering = ["sort_key", "name"]
+
+    def topic_name(self, obj):
+        return obj.name
+    topic_name.short_description = "name"
+    topic_name.admin_order_field = "sort_key"
@@ -0,0 +1,159 @@
+"""
+Sort keys for ordering topic names correctly, independent of the database's
+own collation.
+
+The database compares names using whatever collation the column happens to
+have, which often gets non-ASCII names wrong (and differs between backends).
+Instead, a sort key is computed for each name and stored, as a hex string, in
+a column of its own. Hex strings compare the same way in every collation, so
+ordering by that column gives the same results everywhere and can use an
+index.
+
+Sort keys are computed by the function named in the ACACIA_COLLATION setting
+(a dotted path). It is passed the NFC normalised name and should return a byte
+string or a Unicode string whose code point order is the desired order. The
+default is default_key(). If ACACIA_COLLATION is not set but
+ACACIA_COLLATION_LOCALE is (for example, "de" or "sv_SE") and PyICU is
+installed, the ICU collator for that locale is used instead.
+"""
+
+import binascii
+import sys
+import unicodedata
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router, transaction
+from django.utils.importlib import import_module
+
+from acacia import nestedset, signals
+
+try:
+    import icu
+except ImportError:
+    icu = None
+
+__all__ = ["SORT_KEY_LENGTH", "default_key", "sort_key", "refresh_sort_keys",
+        "lookup_key", "refresh_lookup_keys"]
+
+# Length of the stored sort keys. Longer keys are truncated, so names that only
+# differ a long way in may sort the same (ties are broken by the name).
+SORT_KEY_LENGTH = 255
+
+_collation = None
+
+# Full case foldings that lower() doesn't do.
+_FOLDINGS = {
+    u"\xdf": u"ss",        # sharp s
+    u"\u1e9e": u"ss",      # capital sharp s
+    u"\u017f": u"s",       # long s
+    u"\u03c2": u"\u03c3",  # final sigma
+}
+
+
+def default_key(name):
+    """
+    Orders names case-insensitively and ignoring accents, so that u"\\xe9cole"
+    sorts next to u"ecole" (and before u"ecureuil"), rather than after u"zoo"
+    as it would by code point.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return u"".join([char for char in decomposed
+            if not unicodedata.combining(char)]).lower()
+
+def _icu_key(locale):
+    collator = icu.Collator.createInstance(icu.Locale(locale))
+    return collator.getSortKey
+
+def get_collation():
+    """
+    Returns the sort key function selected by the settings.
+    """
+    # pylint: disable-msg=W0603
+    global _collation
+    if _collation is None:
+        path = getattr(settings, "ACACIA_COLLATION", None)
+        locale = getattr(settings, "ACACIA_COLLATION_LOCALE", None)
+        if path:
+            module_name, attr = path.rsplit(".", 1)
+            try:
+                _collation = getattr(import_module(module_name), attr)
+            except (ImportError, AttributeError):
+                # Not "except ... as", which needs Python 2.6.
+                raise ImproperlyConfigured("Unable to load ACACIA_COLLATION "
+                        "'%s': %s" % (path, sys.exc_info()[1]))
+        elif locale and icu is not None:
+            _collation = _icu_key(locale)
+        else:
+            _collation = default_key
+    return _collation
+
+def sort_key(name):
+    """
+    Returns the stored form of the sort key for 'name'.
+    """
+    key = get_collation()(unicodedata.normalize("NFC", name))
+    if isinstance(key, unicode):
+        # UTF-8 byte order is the same as code point order.
+        key = key.encode("utf-8")
+    return binascii.hexlify(key)[:SORT_KEY_LENGTH].decode("ascii")
+
+def refresh_sort_keys(model, using=None):
+    """
+    Recomputes the sort keys of every node of 'model' (a subclass of
+    CollatedTopic), for example after the collation settings have changed or
+    when the column has just been added. Trees containing changed keys are
+    renumbered so that their children are in the new order.
+
+    Returns the number of nodes whose sort key changed.
+    """
+    db = using or router.db_for_write(model)
+    manager = model._default_manager.db_manager(db)
+    tree_attr = model._meta.tree_id_attr
+
+    def refresh():
+        trees = set()
+        changed = 0
+        for pk, name, old_key, tree_id in manager.values_list(
+                model._meta.pk.name, "name", "sort_key", tree_attr):
+            key = sort_key(name)
+            if key != old_key:
+                manager.filter(pk=pk).update(sort_key=key)
+                trees.add(tree_id)
+                changed += 1
+        if trees:
+            nestedset.renumber(model, trees, db)
+        return changed
+    return transaction.commit_on_success(using=db)(refresh)()
+
+def lookup_key(name):
+    """
+    Returns the case folded, NFC normalised form of 'name', under which names
+    that differ only in case or Unicode normalisation are the same.
+    """
+    folded = unicodedata.normalize("NFC", name).lower()
+    for char, replacement in _FOLDINGS.items():
+        folded = folded.replace(char, replacement)
+    return unicodedata.normalize("NFC", folded)
+
+def refresh_lookup_keys(model, using=None):
+    """
+    Recomputes the lookup keys of every node of 'model' (a subclass of
+    NormalisedTopic), for example when the column has just been added.
+    Returns the number of nodes whose key changed.
+    """
+    db = using or router.db_for_write(model)
+    manager = model._default_manager.db_manager(db)
+
+    def refresh():
+        changed = 0
+        for pk, name, old_key in manager.values_list(model._meta.pk.name,
+                "name", "name_key"):
+            key = lookup_key(name)
+            if key != old_key:
+                manager.filter(pk=pk).update(name_key=key)
+                changed += 1
+        if changed:
+            signals.tree_changed.send(sender=model, tree_ids=None)
+        return changed
+    return transaction.commit_on_success(using=db)(refresh)()
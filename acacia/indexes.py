@@ -0,0 +1,93 @@
+"""
+Composite indexes for the queries that Acacia makes.
+
+Django (as of 1.2) can only create single column indexes and unique
+constraints from a model's Meta. Topic models instead list their composite
+indexes in an "index_together" class attribute, as sequences of field names,
+and the indexes are created after syncdb creates the table. For existing
+tables, the sqltopicindexes management command prints the SQL.
+"""
+
+import sys
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.util import truncate_name
+
+__all__ = ["sql_for_model", "create_indexes"]
+
+# Queries listing the names of the indexes on a table, by backend.
+INDEX_NAME_QUERIES = {
+    "sqlite3": "SELECT name FROM sqlite_master WHERE type = 'index' AND "
+            "tbl_name = %s",
+    "postgresql": "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+    "mysql": "SELECT index_name FROM information_schema.statistics WHERE "
+            "table_schema = DATABASE() AND table_name = %s",
+    "oracle": "SELECT index_name FROM user_indexes WHERE table_name = "
+            "UPPER(%s)",
+}
+
+
+def _indexes(model, connection):
+    """
+    Returns (index name, statement) pairs for the composite indexes declared
+    by 'model'.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    result = []
+    for fields in getattr(model, "index_together", ()):
+        columns = [opts.get_field(name).column for name in fields]
+        name = truncate_name("%s_%s" % (opts.db_table, "_".join(columns)),
+                connection.ops.max_name_length())
+        result.append((name, "CREATE INDEX %s ON %s (%s);" % (qn(name),
+                qn(opts.db_table), ", ".join([qn(column)
+                for column in columns]))))
+    return result
+
+def _existing_names(connection, cursor, table):
+    """
+    Returns the set of (lower case) names of the indexes on 'table', or None
+    if the backend isn't known.
+    """
+    engine = connection.settings_dict["ENGINE"]
+    for backend, query in INDEX_NAME_QUERIES.items():
+        if backend in engine:
+            cursor.execute(query, [table])
+            return set([row[0].lower() for row in cursor.fetchall()])
+    return None
+
+def sql_for_model(model, connection):
+    """
+    Returns the list of SQL statements that create the composite indexes
+    declared by 'model'.
+    """
+    return [statement for _, statement in _indexes(model, connection)]
+
+def create_indexes(sender, created_models, verbosity=1, db=DEFAULT_DB_ALIAS,
+        **kwargs):
+    """
+    A post_syncdb handler that creates the composite indexes of any newly
+    created models that declare them. Indexes that already exist are skipped,
+    since flush also sends post_syncdb, for every model.
+    """
+    # pylint: disable-msg=W0613
+    app_label = sender.__name__.split(".")[-2]
+    connection = connections[db]
+    cursor = connection.cursor()
+    for model in created_models:
+        if model._meta.app_label != app_label:
+            # post_syncdb is sent once per application.
+            continue
+        statements = _indexes(model, connection)
+        if not statements:
+            continue
+        existing = _existing_names(connection, cursor, model._meta.db_table)
+        if existing is not None:
+            statements = [(name, statement) for name, statement in statements
+                    if name.lower() not in existing]
+        if statements and verbosity >= 1:
+            sys.stdout.write("Installing composite indexes for %s.%s model\n"
+                    % (model._meta.app_label, model._meta.object_name))
+        for _, statement in statements:
+            cursor.execute(statement)
+    transaction.commit_unless_managed(using=db)
@@ -0,0 +1,213 @@
+"""
+Optional timing and query counting for the more expensive Acacia operations.
+
+Instrumentation is off by default (set ACACIA_INSTRUMENTATION = True in the
+settings, or call enable()). When it is off, each instrumented call costs a
+single flag check. When it is on, every instrumented call sends an
+acacia.signals.operation_timed signal once it completes, reporting the wall
+time, the number of database queries executed and the number of rows those
+queries returned or modified. Nested instrumented calls (such as the
+get_by_full_name() call inside get_or_create_by_full_name()) are reported
+separately and the outer call's figures include the inner one's.
+
+SlowCallLogger is a ready-made receiver for that signal which remembers and
+logs the slowest calls.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, models
+from django.utils.functional import wraps
+
+from acacia import signals
+
+__all__ = ["enable", "disable", "is_enabled", "instrumented",
+        "SlowCallLogger"]
+
+_enabled = getattr(settings, "ACACIA_INSTRUMENTATION", False)
+_state = threading.local()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+
+class _Counter(object):
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+
+class CountingCursor(object):
+    """
+    Wraps a database cursor, adding the queries it executes and the rows they
+    touch to every active counter.
+    """
+    def __init__(self, cursor, counters):
+        self.cursor = cursor
+        self.counters = counters
+
+    def _count(self, queries, rows):
+        for counter in self.counters:
+            counter.queries += queries
+            counter.rows += rows
+
+    def _executed(self, sql):
+        # Not all backends know how many rows a SELECT returns in advance, so
+        # those rows are counted as they are fetched instead.
+        rows = getattr(self.cursor, "rowcount", -1)
+        if rows is None or rows < 0 or sql.lstrip()[:6].upper() == "SELECT":
+            rows = 0
+        self._count(1, rows)
+
+    def execute(self, sql, params=()):
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self._executed(sql)
+
+    def executemany(self, sql, param_list):
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self._executed(sql)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self._count(0, 1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self._count(0, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self._count(0, len(rows))
+        return rows
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+def _install(counters):
+    """
+    Makes every database connection (in this thread) hand out counting
+    cursors. Connection objects are thread-local, so this doesn't affect
+    other threads.
+    """
+    for connection in connections.all():
+        original = connection.cursor
+        def cursor(original=original):
+            return CountingCursor(original(), counters)
+        connection.cursor = cursor
+
+def _uninstall():
+    for connection in connections.all():
+        if "cursor" in connection.__dict__:
+            del connection.cursor
+
+def instrumented(operation, sender=None):
+    """
+    Decorator that reports each call of the decorated method through the
+    operation_timed signal, with 'operation' as the operation name. The
+    sender is the model class (taken from the method's instance or, for
+    managers and template nodes, its "model" attribute).
+
+    To decorate a plain function, pass a 'sender' function, which is called
+    with the same arguments as the decorated function and returns the model
+    class to send the signal as.
+    """
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            counters = getattr(_state, "counters", None)
+            if counters is None:
+                counters = _state.counters = []
+            counter = _Counter()
+            counters.append(counter)
+            if len(counters) == 1:
+                _install(counters)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.time() - start
+                counters.pop()
+                if not counters:
+                    _uninstall()
+                if sender is not None:
+                    model = sender(*args, **kwargs)
+                elif isinstance(args[0], models.Model):
+                    model = args[0].__class__
+                else:
+                    model = args[0].model
+                signals.operation_timed.send(sender=model,
+                        operation=operation, duration=duration,
+                        queries=counter.queries, rows=counter.rows)
+        return wraps(func)(wrapper)
+    return decorator
+
+
+class SlowCallLogger(object):
+    """
+    A receiver for the operation_timed signal that remembers the 'keep'
+    slowest calls it has seen and logs a warning for any call that takes at
+    least 'threshold' seconds.
+    """
+    def __init__(self, threshold=0.5, keep=20, logger="acacia"):
+        self.threshold = threshold
+        self.keep = keep
+        self.logger = logging.getLogger(logger)
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sender, operation, duration, queries, rows, **kwargs):
+        entry = (duration, sender.__name__, operation, queries, rows)
+        self._lock.acquire()
+        try:
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, entry)
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+        finally:
+            self._lock.release()
+        if duration >= self.threshold:
+            self.logger.warning("Slow call: %s.%s took %.3fs (%d queries, "
+                    "%d rows)", sender.__name__, operation, duration,
+                    queries, rows)
+
+    def connect(self):
+        signals.operation_timed.connect(self, dispatch_uid=id(self))
+
+    def disconnect(self):
+        signals.operation_timed.disconnect(dispatch_uid=id(self))
+
+    def slowest(self):
+        """
+        Returns the slowest calls seen so far, slowest first, as (duration,
+        model name, operation, queries, rows) tuples.
+        """
+        self._lock.acquire()
+        try:
+            return sorted(self._heap, reverse=True)
+        finally:
+            self._lock.release()
@@ -0,0 +1,269 @@
+"""
+Checking and repairing the nested set values of topic trees.
+
+If a process dies partway through changing a tree outside a transaction, the
+left, right and level values that mptt maintains can be left inconsistent with
+the parent links. Lookups that rely on those values, such as
+get_by_full_name() (which filters on level), then silently return the wrong
+results. verify() finds such problems and repair() rebuilds the affected
+trees from their parent links.
+"""
+
+from django.db import router, transaction
+from django.db.models import Count
+
+from acacia import nestedset
+
+__all__ = ["verify_tree", "duplicate_roots", "verify", "repair_tree",
+        "repair", "process_tree", "tree_ids", "DEFERRED"]
+
+# Returned by process_tree() for trees that can't safely be repaired
+# alongside others (see there).
+DEFERRED = "deferred"
+
+
+def tree_ids(model, using=None):
+    """
+    Returns an iterator over all the tree ids in use, in order.
+    """
+    db = using or router.db_for_read(model)
+    tree_id = model._meta.tree_id_attr
+    return model._default_manager.db_manager(db).order_by(tree_id).values_list(
+            tree_id, flat=True).distinct().iterator()
+
+def _duplicates_adjacent(model):
+    """
+    Returns True if siblings with the same name (by the model's lookup_field)
+    are always next to each other in mptt's sibling order. That is the case
+    when the order_insertion_by fields include the lookup field and are all
+    determined by it, so that anything ordered between two duplicates is a
+    duplicate too.
+    """
+    fields = list(model._meta.order_insertion_by or [])
+    derived = set([model.lookup_field])
+    if model.lookup_field == "name":
+        # Sort keys are computed from the name (see CollatedTopic).
+        derived.add("sort_key")
+    if model.lookup_field not in fields:
+        return False
+    for field in fields:
+        if field not in derived:
+            return False
+    return True
+
+def verify_tree(model, tree_id, using=None):
+    """
+    Checks the tree with the given tree id, returning a list of (tree id,
+    node id, description) triples for any problems found.
+
+    The nodes are read in a single pass, in left value order, and only the
+    chain of ancestors of the current node is kept in memory. The checks are
+    that each tree has a single root, the left and right values are contiguous
+    and correctly nested, the level and parent of each node match the nesting
+    and no two siblings have the same name (compared by the model's
+    lookup_field, so "Cat" and "cat" are duplicates for a NormalisedTopic).
+
+    When the siblings' order puts duplicates next to each other (see
+    _duplicates_adjacent()), only the previous sibling's name is kept, so
+    memory use grows with the depth of the tree. Otherwise the names of all
+    the children seen so far are kept for each node on the current path, so
+    it also grows with the number of children of those nodes.
+    """
+    # pylint: disable-msg=R0912
+    db = using or router.db_for_read(model)
+    opts = model._meta
+    rows = model._default_manager.db_manager(db).filter(**{
+            opts.tree_id_attr: tree_id}).order_by(opts.left_attr).values_list(
+            opts.pk.name, opts.parent_attr, model.lookup_field, opts.left_attr,
+            opts.right_attr, opts.level_attr).iterator()
+    problems = []
+
+    def report(pk, message):
+        problems.append((tree_id, pk, message))
+
+    by_name = _duplicates_adjacent(model)
+    # Each entry is [pk, rght, the previous child's name or the set of child
+    # names seen so far].
+    stack = []
+    counter = 0
+
+    def close(frame, counter):
+        if frame[1] != counter + 1:
+            report(frame[0], "right value is %d, expected %d" % (frame[1],
+                    counter + 1))
+        return max(frame[1], counter + 1)
+
+    seen_root = False
+    for pk, parent_id, name, lft, rght, level in rows:
+        while stack and stack[-1][1] < lft:
+            counter = close(stack.pop(), counter)
+        if lft != counter + 1:
+            report(pk, "left value is %d, expected %d" % (lft, counter + 1))
+        counter = lft
+        if rght <= lft or (rght - lft) % 2 != 1:
+            report(pk, "invalid left and right values (%d, %d)" % (lft, rght))
+        if stack:
+            top = stack[-1]
+            if rght >= top[1]:
+                report(pk, "range overlaps the end of its parent's range")
+            if parent_id != top[0]:
+                report(pk, "parent is %s, but nested inside %s" % (parent_id,
+                        top[0]))
+            if by_name:
+                duplicate = name == top[2]
+                top[2] = name
+            else:
+                duplicate = name in top[2]
+                top[2].add(name)
+            if duplicate:
+                report(pk, "another child of %s is also named '%s'" % (top[0],
+                        name))
+        else:
+            if seen_root:
+                report(pk, "more than one root node in the tree")
+            seen_root = True
+            if parent_id is not None:
+                report(pk, "parent is %s, but the node is at the top of the "
+                        "tree" % parent_id)
+        if level != len(stack):
+            report(pk, "level is %d, expected %d" % (level, len(stack)))
+        if by_name:
+            stack.append([pk, rght, None])
+        else:
+            stack.append([pk, rght, set()])
+    while stack:
+        counter = close(stack.pop(), counter)
+    return problems
+
+def duplicate_roots(model, using=None):
+    """
+    Returns a list of (tree id, node id, description) triples for root nodes
+    sharing a name (by the model's lookup_field) with an earlier root node
+    (the database doesn't prevent this, as their parent is NULL).
+    """
+    db = using or router.db_for_read(model)
+    opts = model._meta
+    field = model.lookup_field
+    roots = model._default_manager.db_manager(db).filter(**{
+            "%s__isnull" % opts.parent_attr: True})
+    names = roots.values(field).annotate(count=Count(opts.pk.name)).filter(
+            count__gt=1).values_list(field, flat=True)
+    problems = []
+    first = {}
+    for pk, name, tree_id in roots.filter(**{"%s__in" % field: list(names)}
+            ).order_by(opts.tree_id_attr, opts.pk.name).values_list(
+            opts.pk.name, field, opts.tree_id_attr):
+        if name in first:
+            problems.append((tree_id, pk, "root node '%s' duplicates node %s"
+                    % (name, first[name])))
+        else:
+            first[name] = pk
+    return problems
+
+def verify(model, trees=None, using=None):
+    """
+    Checks the trees with the given tree ids (default: all of them) and
+    returns an iterator over the problems found, as (tree id, node id,
+    description) triples. Also checks that no two root nodes have the same
+    name.
+    """
+    db = using or router.db_for_read(model)
+    if trees is None:
+        trees = tree_ids(model, db)
+    trees = set(trees)
+    for tree_id in sorted(trees):
+        for problem in verify_tree(model, tree_id, db):
+            yield problem
+    for problem in duplicate_roots(model, db):
+        if problem[0] in trees:
+            yield problem
+
+def _connected_trees(model, tree_id, db):
+    """
+    Returns the set of tree ids containing 'tree_id' and, transitively, any
+    trees holding the parents of its nodes or the children of them.
+    """
+    opts = model._meta
+    manager = model._default_manager.db_manager(db)
+    parent_tree = "%s__%s" % (opts.parent_attr, opts.tree_id_attr)
+    found = set([tree_id])
+    pending = [tree_id]
+    while pending:
+        current = pending.pop()
+        queryset = manager.filter(**{opts.tree_id_attr: current}).exclude(**{
+                "%s__isnull" % opts.parent_attr: True}).exclude(**{
+                parent_tree: current}).values_list(parent_tree, flat=True)
+        linked = set(queryset)
+        linked.update(manager.filter(**{parent_tree: current}).exclude(**{
+                opts.tree_id_attr: current}).values_list(opts.tree_id_attr,
+                flat=True))
+        for other in linked - found:
+            found.add(other)
+            pending.append(other)
+    return found
+
+def repair_tree(model, tree_id, using=None):
+    """
+    Rebuilds the nested set values of the tree with the given tree id (and
+    any trees its nodes' parent links lead into) from the parent links, in a
+    single transaction. Returns the number of nodes updated.
+
+    Raises ValueError, without changing anything, if the parent links form a
+    cycle.
+    """
+    db = using or router.db_for_write(model)
+    trees = _connected_trees(model, tree_id, db)
+    return transaction.commit_on_success(using=db)(nestedset.renumber)(model,
+            trees, db)
+
+def repair(model, trees=None, using=None, verify_first=True):
+    """
+    Repairs the trees with the given tree ids (default: all of them), one
+    tree per transaction, so that each one is only locked briefly and the
+    site can keep running while this happens. If 'verify_first' is True, only
+    trees that fail verification are rebuilt.
+
+    Returns a list of (tree id, number of nodes updated or None if the tree
+    couldn't be repaired because its parent links form a cycle) pairs.
+    """
+    db = using or router.db_for_write(model)
+    if trees is None:
+        trees = list(tree_ids(model, db))
+    results = []
+    for tree_id in trees:
+        if verify_first and not verify_tree(model, tree_id, db):
+            continue
+        try:
+            results.append((tree_id, repair_tree(model, tree_id, db)))
+        except ValueError:
+            results.append((tree_id, None))
+    return results
+
+def process_tree(model, tree_id, using=None, repair=False, rebuild=False):
+    """
+    Does the work on a single tree for a parallel run: verifies it and, if
+    'repair' is True and there are problems (or 'rebuild' is True), rebuilds
+    it. Returns (tree id, problems, number of nodes updated) where the last
+    value is None if nothing was rebuilt or the tree couldn't be repaired,
+    or DEFERRED.
+
+    Rebuilding a tree with more than one root, or with parent links into
+    other trees, allocates new tree ids or touches those other trees, so
+    doing it at the same time as other trees are rebuilt isn't safe. Such
+    trees are left alone and DEFERRED is returned; pass them to repair()
+    once the parallel work is done.
+    """
+    db = using or router.db_for_write(model)
+    problems = verify_tree(model, tree_id, db)
+    if not (rebuild or (repair and problems)):
+        return tree_id, problems, None
+    opts = model._meta
+    roots = model._default_manager.db_manager(db).filter(**{
+            opts.tree_id_attr: tree_id,
+            "%s__isnull" % opts.parent_attr: True}).count()
+    if roots != 1 or _connected_trees(model, tree_id, db) != set([tree_id]):
+        return tree_id, problems, DEFERRED
+    try:
+        return tree_id, problems, repair_tree(model, tree_id, db)
+    except ValueError:
+        return tree_id, problems, None
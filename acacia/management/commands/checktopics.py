@@ -0,0 +1,181 @@
+import itertools
+import os
+import signal
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+from acacia import integrity
+from acacia.management.commands.synctopics import get_topic_model
+
+
+def _init_worker():
+    # Leave interrupts to the parent, so that it can stop cleanly with the
+    # checkpoint file up to date.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _work(task):
+    """
+    Processes one tree in a worker. Each worker process opens its own
+    database connection the first time it makes a query.
+    """
+    label, db, tree_id, repair, rebuild = task
+    model = models.get_model(*label.split("."))
+    return integrity.process_tree(model, tree_id, db, repair, rebuild)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--model", action="store", dest="model",
+            default="acacia.Topic", help="The topic model to check, as "
+                "app_label.ModelName. Defaults to acacia.Topic."),
+        make_option("--database", action="store", dest="database",
+            default=DEFAULT_DB_ALIAS, help="Nominates the database to check. "
+                "Defaults to the \"default\" database."),
+        make_option("--repair", action="store_true", dest="repair",
+            default=False, help="Rebuild any trees that have problems, one "
+                "tree per transaction."),
+        make_option("--rebuild", action="store_true", dest="rebuild",
+            default=False, help="Rebuild every tree, whether or not it has "
+                "problems."),
+        make_option("--processes", action="store", type="int",
+            dest="processes", default=1, help="Number of worker processes to "
+                "divide the trees between (needs Python 2.6). Defaults to 1."),
+        make_option("--checkpoint", action="store", dest="checkpoint",
+            default=None, help="File recording the trees already done, so "
+                "that an interrupted run can be resumed by running the same "
+                "command again. It is removed when the run finishes."),
+    )
+    help = ("Checks the nested set values of a topic tree against the parent "
+            "links and optionally repairs them. Checks every tree unless some "
+            "tree ids are given.")
+    args = "[tree_id ...]"
+
+    def handle(self, *args, **options):
+        # pylint: disable-msg=R0912,R0914,R0915
+        model = get_topic_model(options["model"])
+        db = options["database"]
+        try:
+            trees = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError("Tree ids must be integers.")
+        if not trees:
+            trees = list(integrity.tree_ids(model, db))
+        selected = set(trees)
+        processes = options["processes"]
+        if processes < 1:
+            raise CommandError("--processes must be at least 1.")
+        repair = options["repair"] or options["rebuild"]
+        verbosity = int(options.get("verbosity", 1))
+
+        checkpoint = options["checkpoint"]
+        done = set()
+        if checkpoint and os.path.exists(checkpoint):
+            checkpoint_file = open(checkpoint)
+            try:
+                done = set([int(line) for line in checkpoint_file
+                        if line.strip()])
+            finally:
+                checkpoint_file.close()
+            if verbosity > 0:
+                sys.stderr.write("Resuming: %d trees already done.\n" %
+                        len(done & selected))
+        trees = [tree_id for tree_id in trees if tree_id not in done]
+
+        label = "%s.%s" % (model._meta.app_label, model._meta.object_name)
+        tasks = [(label, db, tree_id, repair, options["rebuild"])
+                for tree_id in trees]
+        pool = None
+        if processes > 1 and len(tasks) > 1:
+            # Close the connections before forking, so that no worker
+            # shares one with the parent or another worker.
+            for connection in connections.all():
+                connection.close()
+            # Imported here, since multiprocessing needs Python 2.6.
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, _init_worker)
+            chunksize = max(1, min(100, len(tasks) // (processes * 20)))
+            results = pool.imap_unordered(_work, tasks, chunksize)
+        else:
+            results = itertools.imap(_work, tasks)
+
+        broken = set()
+        deferred = []
+        failed = []
+        repaired = 0
+        count = 0
+        last_report = time.time()
+        if checkpoint:
+            checkpoint_file = open(checkpoint, "a")
+        try:
+            for tree_id, problems, updated in results:
+                for _, pk, message in problems:
+                    sys.stdout.write(("tree %s, node %s: %s\n" % (tree_id, pk,
+                            message)).encode("utf-8"))
+                if problems:
+                    broken.add(tree_id)
+                if updated == integrity.DEFERRED:
+                    deferred.append(tree_id)
+                else:
+                    if updated is not None:
+                        repaired += 1
+                    elif problems and repair:
+                        failed.append(tree_id)
+                    if checkpoint:
+                        checkpoint_file.write("%d\n" % tree_id)
+                        checkpoint_file.flush()
+                count += 1
+                if verbosity > 0 and (count == len(tasks) or
+                        time.time() - last_report >= 1):
+                    last_report = time.time()
+                    sys.stderr.write("Processed %d of %d trees.\n" % (count,
+                            len(tasks)))
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+
+            # Trees linked to other trees are repaired one at a time.
+            for tree_id, updated in integrity.repair(model, deferred, db,
+                    verify_first=False):
+                if updated is None:
+                    failed.append(tree_id)
+                else:
+                    repaired += 1
+                if checkpoint:
+                    checkpoint_file.write("%d\n" % tree_id)
+                    checkpoint_file.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if checkpoint:
+                checkpoint_file.close()
+
+        duplicates = [problem for problem in integrity.duplicate_roots(model,
+                db) if problem[0] in selected]
+        for tree_id, pk, message in duplicates:
+            broken.add(tree_id)
+            sys.stdout.write(("tree %s, node %s: %s\n" % (tree_id, pk,
+                    message)).encode("utf-8"))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        if verbosity > 0:
+            if repair:
+                sys.stdout.write("%d trees checked, %d with problems, %d "
+                        "rebuilt.\n" % (count, len(broken), repaired))
+            elif not broken:
+                sys.stdout.write("No problems found.\n")
+        if failed:
+            raise CommandError("Unable to repair trees %s: the parent links "
+                    "form a cycle." % ", ".join([str(pk) for pk in
+                    sorted(failed)]))
+        if duplicates and repair:
+            raise CommandError("Root nodes with duplicate names can't be "
+                    "repaired automatically; rename or merge them.")
+        if broken and not repair:
+            raise CommandError("Problems found in %d trees." % len(broken))
@@ -0,0 +1,37 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from acacia import snapshot
+from acacia.management.commands.synctopics import get_topic_model
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--model", action="store", dest="model",
+            default="acacia.Topic", help="The topic model to snapshot, as "
+                "app_label.ModelName. Defaults to acacia.Topic."),
+        make_option("--database", action="store", dest="database",
+            default=DEFAULT_DB_ALIAS, help="Nominates the database to read. "
+                "Defaults to the \"default\" database."),
+    )
+    help = ("Writes a snapshot of a topic tree to a file, for worker "
+            "processes to open with acacia.snapshot.TreeSnapshot.")
+    args = "<file>"
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Exactly one file name is required.")
+        if not snapshot.is_enabled():
+            raise CommandError("Set ACACIA_SNAPSHOTS to True first, or the "
+                    "snapshot will never be used.")
+        model = get_topic_model(options["model"])
+        try:
+            version = snapshot.dump(model, args[0], options["database"])
+        except (IOError, OSError):
+            raise CommandError("Unable to write %s: %s" % (args[0],
+                    sys.exc_info()[1]))
+        if int(options.get("verbosity", 1)) > 0:
+            sys.stdout.write("Wrote %s (version %s).\n" % (args[0], version))
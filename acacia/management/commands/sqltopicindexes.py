@@ -0,0 +1,30 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+from acacia import indexes
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--database", action="store", dest="database",
+            default=DEFAULT_DB_ALIAS, help="Nominates a database to print the "
+                "SQL for. Defaults to the \"default\" database."),
+    )
+    help = ("Prints the CREATE INDEX statements for the composite indexes of "
+            "the topic models in the given apps (default: all apps), for "
+            "adding them to existing tables.")
+    args = "[app_label ...]"
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if args:
+            apps = [models.get_app(label) for label in args]
+        else:
+            apps = models.get_apps()
+        for app in apps:
+            for model in models.get_models(app):
+                for statement in indexes.sql_for_model(model, connection):
+                    sys.stdout.write(statement + "\n")
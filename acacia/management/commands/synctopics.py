@@ -0,0 +1,76 @@
+import codecs
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, models
+
+
+def get_topic_model(label):
+    """
+    Returns the model class for an "app_label.ModelName" label.
+    """
+    try:
+        app_label, model_name = label.rsplit(".", 1)
+    except ValueError:
+        raise CommandError("Model must be given as app_label.ModelName, not "
+                "'%s'." % label)
+    model = models.get_model(app_label, model_name)
+    if model is None:
+        raise CommandError("Unknown model: %s" % label)
+    return model
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--model", action="store", dest="model",
+            default="acacia.Topic", help="The topic model to synchronise, as "
+                "app_label.ModelName. Defaults to acacia.Topic."),
+        make_option("--database", action="store", dest="database",
+            default=DEFAULT_DB_ALIAS, help="Nominates the database to "
+                "synchronise. Defaults to the \"default\" database."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+            default=False, help="Only display the planned changes."),
+        make_option("--noinput", action="store_false", dest="interactive",
+            default=True, help="Apply the changes without asking for "
+                "confirmation."),
+    )
+    help = ("Makes a topic tree match the full names listed in a file (one "
+            "per line, with blank lines and lines starting with '#' "
+            "ignored), moving existing topics wherever possible.")
+    args = "<file>"
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Exactly one file name is required.")
+        model = get_topic_model(options["model"])
+        try:
+            spec_file = codecs.open(args[0], "r", "utf-8")
+        except IOError:
+            raise CommandError("Unable to open %s." % args[0])
+        try:
+            spec = [line.strip() for line in spec_file]
+        finally:
+            spec_file.close()
+        spec = [line for line in spec if line and not line.startswith("#")]
+
+        manager = model._default_manager.db_manager(options["database"])
+        plan = manager.sync(spec, commit=False)
+        if not plan:
+            sys.stdout.write("No changes needed.\n")
+            return
+        for line in plan.describe():
+            sys.stdout.write(line.encode("utf-8") + "\n")
+        if options["dry_run"]:
+            return
+        if options["interactive"]:
+            confirm = raw_input("\nApply these changes? Type 'yes' to "
+                    "continue, or 'no' to cancel: ")
+            if confirm != "yes":
+                sys.stdout.write("Cancelled.\n")
+                return
+        plan.apply()
+        if int(options.get("verbosity", 1)) > 0:
+            sys.stdout.write("%d created, %d moved, %d merged, %d deleted.\n" %
+                    (len(plan.creates), len(plan.moves), len(plan.merges),
+                    sum([count + 1 for _, _, count in plan.deletes])))
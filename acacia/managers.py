@@ -2,28 +2,46 @@
 Custom manager for working with topic hierarchies.
 """
 
-from django.db import models
+import operator
+
+from django.db import models, router, transaction
+
+from acacia import nestedset, serialization, signals
+from acacia.instrumentation import instrumented
 
 class TopicManager(models.Manager):
     """
     Some useful methods that operate on topics as a whole. Mostly for locating
     information about a Topic based on its full name.
+
+    All the queries made by one method call go to the same database: the one
+    selected with db_manager() or, failing that, the one chosen by the
+    database routers (for reading or writing, as appropriate).
     """
+    @instrumented("get_by_full_name")
     def get_by_full_name(self, full_name):
         """
-        Returns the topic with the given full name.
+        Returns the topic with the given full name. Each piece of the name is
+        matched against the model's lookup_field (the exact name, unless the
+        model normalises names).
 
         Raises Topic.DoesNotExist if there is no tag with 'full_name'.
         """
         # Ensure foo//bar is the same as foo/bar. Nice to have.
         sep = self.model.separator
-        pieces = [o for o in full_name.split(sep) if o]
-        for candidate in self.filter(level=len(pieces)-1, name=pieces[-1]):
-            parents = candidate.get_ancestors().values_list("name", flat=True)
+        key = self.model.lookup_key
+        field = self.model.lookup_field
+        pieces = [key(o) for o in full_name.split(sep) if o]
+        db = self.db
+        for candidate in self.using(db).filter(level=len(pieces)-1,
+                **{field: pieces[-1]}):
+            parents = candidate.get_ancestors().using(db).values_list(field,
+                    flat=True)
             if list(parents) == pieces[:-1]:
                 return candidate
         raise self.model.DoesNotExist
 
+    @instrumented("get_subtree")
     def get_subtree(self, full_name):
         """
         Returns a list containing the tag with the given full name and all tags
@@ -32,8 +50,79 @@ class TopicManager(models.Manager):
 
         Raises Topic.DoesNotExist if there is no tag with 'long_name'.
         """
-        return self.get_by_full_name(full_name).get_descendants(True)
+        # pylint: disable-msg=W0212
+        node = self.get_by_full_name(full_name)
+        return node.get_descendants(True).using(node._state.db)
+
+    @instrumented("get_nested_subtree")
+    def get_nested_subtree(self, full_name, fields=None, depth=None):
+        """
+        Returns the topic with the given full name and its descendants as
+        nested dictionaries, read with a single query for the subtree. See
+        acacia.serialization.nested() for the arguments.
+
+        Raises Topic.DoesNotExist if there is no tag with 'full_name'.
+        """
+        node = self.get_by_full_name(full_name)
+        return serialization.nested(node, fields, depth)
+
+    def iter_subtree_json(self, full_name, fields=None, depth=None):
+        """
+        Returns an iterator over pieces of the nested JSON encoding of the
+        topic with the given full name and its descendants, produced as the
+        subtree is read. See acacia.serialization.iter_json().
+
+        Raises Topic.DoesNotExist (straight away) if there is no tag with
+        'full_name'.
+        """
+        node = self.get_by_full_name(full_name)
+        return serialization.iter_json(node, fields, depth)
+
+    @instrumented("prefetch_ancestors")
+    def prefetch_ancestors(self, topics):
+        """
+        Loads the ancestors of all the topics in 'topics' (None values are
+        skipped) with a single query, so that calling ancestor_path() or
+        full_name() on any of them (or their ancestors) doesn't need any more
+        queries. Useful for listing pages that show a path for each item.
 
+        Returns 'topics' as a list.
+        """
+        # pylint: disable-msg=W0212
+        topics = list(topics)
+        nodes = [topic for topic in topics
+                if topic is not None and topic.parent_id is not None]
+        if not nodes:
+            for topic in topics:
+                if topic is not None:
+                    topic._set_ancestor_path([topic])
+            return topics
+        opts = self.model._meta
+        tree_attr, left, right = (opts.tree_id_attr, opts.left_attr,
+                opts.right_attr)
+        conditions = {}
+        for node in nodes:
+            key = (getattr(node, tree_attr), getattr(node, left),
+                    getattr(node, right))
+            conditions[key] = models.Q(**{tree_attr: key[0],
+                    "%s__lt" % left: key[1], "%s__gt" % right: key[2]})
+        query = reduce(operator.or_, conditions.values())
+        by_tree = {}
+        for ancestor in self.using(self.db).filter(query).order_by(tree_attr,
+                left):
+            by_tree.setdefault(getattr(ancestor, tree_attr), []).append(
+                    ancestor)
+        for topic in topics:
+            if topic is None:
+                continue
+            lft, rght = getattr(topic, left), getattr(topic, right)
+            ancestors = [node for node in by_tree.get(getattr(topic,
+                    tree_attr), []) if getattr(node, left) < lft and
+                    getattr(node, right) > rght]
+            topic._set_ancestor_path(ancestors + [topic])
+        return topics
+
+    @instrumented("get_or_create_by_full_name")
     def get_or_create_by_full_name(self, full_name):
         """
         Retrieves a topic with the given full_name. If the topic doesn't exist,
@@ -43,9 +132,16 @@ class TopicManager(models.Manager):
 
         Returns a pair: the topic object and a boolean flag indicating whether
         or not a new object was created.
+
+        Since this may write to the database, the initial lookup is also made
+        on the database used for writing, so that a lagging read replica can't
+        cause a duplicate to be created.
         """
+        manager = self
+        if self._db is None:
+            manager = self.db_manager(router.db_for_write(self.model))
         try:
-            node = self.get_by_full_name(full_name)
+            node = manager.get_by_full_name(full_name)
             return node, False
         except self.model.DoesNotExist:
             pass
@@ -53,11 +149,77 @@ class TopicManager(models.Manager):
         # TODO: Feels like I should be able to do this with fewer queries.
         pieces = full_name.rsplit(self.model.separator, 1)
         if len(pieces) == 1:
-            return self.create(name=pieces[0]), True
-        parent, created = self.get_or_create_by_full_name(pieces[0])
+            return manager.create(name=pieces[0]), True
+        parent, created = manager.get_or_create_by_full_name(pieces[0])
         if not pieces[1]:
             # full_name ended with a trailing separator (e.g. /foo/bar/).
             return parent, created
-        node = self.create(name=pieces[-1], parent=parent)
+        node = manager.create(name=pieces[-1], parent=parent)
         return node, True
 
+
+    def bulk_move(self, moves):
+        """
+        Moves many subtrees at once. 'moves' is a list of (node, new_parent)
+        pairs and each node (with its descendants) becomes a child of
+        new_parent, or a root node if new_parent is None. Siblings are kept in
+        order_insertion_by order.
+
+        This is much faster than calling move_to() for each node, since mptt
+        shifts the left and right values of a large part of the table for
+        every move. Here, only the parent links are changed and then each
+        affected tree is renumbered once.
+
+        All the moves are checked before anything is changed. Raises
+        mptt.exceptions.InvalidMove if any node would become a descendant of
+        itself. A single pre_move signal, listing every move, is sent before
+        the changes are made (with the model class as the sender). The node
+        instances are updated to match their new positions.
+        """
+        moves = list(moves)
+        if not moves:
+            return
+        db = self._db or router.db_for_write(self.model)
+        id_moves = []
+        for node, parent in moves:
+            if parent is None:
+                id_moves.append((node.pk, None))
+            else:
+                id_moves.append((node.pk, parent.pk))
+        tree_ids = nestedset.check_moves(self.model, id_moves, db)
+        signals.pre_move.send(sender=self.model, moving=moves)
+
+        def move():
+            nestedset.reparent(self.model, id_moves, db)
+            nestedset.renumber(self.model, tree_ids, db)
+        transaction.commit_on_success(using=db)(move)()
+
+        opts = self.model._meta
+        attrs = [opts.left_attr, opts.right_attr, opts.level_attr,
+                opts.tree_id_attr]
+        values = {}
+        for row in self.using(db).filter(pk__in=[pk for pk, _ in id_moves]
+                ).values_list(opts.pk.name, *attrs):
+            values[row[0]] = row[1:]
+        for node, parent in moves:
+            setattr(node, opts.parent_attr, parent)
+            for attr, value in zip(attrs, values[node.pk]):
+                setattr(node, attr, value)
+
+    def sync(self, spec, commit=True):
+        """
+        Makes the topic tree contain exactly the nodes named by the full names
+        in 'spec' (and their ancestors), creating, moving, merging and
+        deleting as few nodes as possible. Nodes are moved in preference to
+        being deleted and recreated elsewhere, so they keep their primary
+        keys. The usual pre_move and pre_merge signals are sent.
+
+        Returns an acacia.sync.SyncPlan describing the changes. If 'commit' is
+        False, the changes are only planned, not made; call apply() on the
+        result to make them.
+        """
+        from acacia.sync import SyncPlan
+        plan = SyncPlan(self, spec)
+        if commit:
+            plan.apply()
+        return plan
@@ -7,9 +7,12 @@ shallow view of information organisation here.
 """
 
 import mptt
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import signals as model_signals
 
-from acacia import managers, signals
+from acacia import (collation, indexes, managers, nestedset, serialization,
+        signals, snapshot)
+from acacia.instrumentation import instrumented
 
 
 class AbstractTopic(models.Model):
@@ -27,6 +30,13 @@ class AbstractTopic(models.Model):
 
     objects = managers.TopicManager()
     separator = u"/"
+    # The field that full name lookups match against (after passing each
+    # piece of the name through lookup_key()).
+    lookup_field = "name"
+    # Composite indexes, created after syncdb (see acacia.indexes): full name
+    # lookups filter on level and name, ancestor and descendant queries on
+    # the tree id and left and right values.
+    index_together = [("level", "name"), ("tree_id", "lft", "rght")]
 
     class Meta:
         # pylint: disable-msg=W0232
@@ -36,13 +46,19 @@ class AbstractTopic(models.Model):
     def __unicode__(self):
         return self.full_name()
 
+    @classmethod
+    def lookup_key(cls, name):
+        return name
+
+    @instrumented("full_name")
     def full_name(self):
-        # pylint: disable-msg=W0201,E0203
+        # pylint: disable-msg=W0201,E0203,W0212
         if (not hasattr(self, "_full_name_cache") or
                 self.parent_id != self._cached_parent):
             if self.parent is not None:
+                ancestors = self.get_ancestors().using(self._state.db)
                 parents = self.separator.join(
-                        self.get_ancestors().values_list("name", flat=True))
+                        ancestors.values_list("name", flat=True))
                 self._full_name_cache = u"%s%s%s" % (parents, self.separator,
                         self.name)
             else:
@@ -50,6 +66,47 @@ class AbstractTopic(models.Model):
             self._cached_parent = self.parent_id
         return self._full_name_cache
 
+    def ancestor_path(self):
+        """
+        Returns a list of this node's ancestors, starting at the root,
+        followed by the node itself. The list is cached on the node (and
+        TopicManager.prefetch_ancestors() fills in the cache for many nodes
+        with one query). Calling full_name() on any node in the list doesn't
+        cost a query.
+        """
+        # pylint: disable-msg=W0212
+        if (getattr(self, "_ancestor_path", None) is None or
+                self.parent_id != self._ancestor_parent):
+            ancestors = list(self.get_ancestors().using(self._state.db))
+            self._set_ancestor_path(ancestors + [self])
+        return self._ancestor_path
+
+    def _set_ancestor_path(self, path):
+        # pylint: disable-msg=W0201,W0212
+        names = []
+        for i, node in enumerate(path):
+            names.append(node.name)
+            if getattr(node, "_ancestor_path", None) is None or node is self:
+                node._ancestor_path = path[:i + 1]
+                node._ancestor_parent = node.parent_id
+            node._full_name_cache = self.separator.join(names)
+            node._cached_parent = node.parent_id
+
+    def as_nested(self, fields=None, depth=None):
+        """
+        Returns this node and its descendants as nested dictionaries. See
+        acacia.serialization.nested().
+        """
+        return serialization.nested(self, fields, depth)
+
+    def iter_json(self, fields=None, depth=None):
+        """
+        Returns an iterator over pieces of the nested JSON encoding of this
+        node and its descendants. See acacia.serialization.iter_json().
+        """
+        return serialization.iter_json(self, fields, depth)
+
+    @instrumented("merge_to")
     def merge_to(self, parent):
         """
         A variant on mptt's move_to() method that merges any overlapping
@@ -67,27 +124,34 @@ class AbstractTopic(models.Model):
         moved-but-not-merged is that these nodes won't have their pk values
         changed in the process.)
         """
-        manager = self.__class__.objects
+        # All the reads here are made on the database being written to, so
+        # that they reflect any earlier moves.
+        db = router.db_for_write(self.__class__, instance=self)
+        manager = self.__class__.objects.db_manager(db)
+        field = self.lookup_field
         try:
-            merge_node = manager.get(parent=parent, name=self.name)
+            merge_node = manager.get(parent=parent,
+                    **{field: self.lookup_key(self.name)})
         except self.DoesNotExist:
             signals.pre_move.send(sender=self, moving=[(self, parent)])
-            self.move_to(parent)
+            _move_node(self, parent)
             return
         squash = [(self.id, merge_node.id)]
         examine = [(self, merge_node)]
         to_move = []
         while examine:
             node, merge_node = examine.pop()
-            children = node.get_children()
-            child_names = [obj.name for obj in children]
+            children = node.get_children().using(db)
+            child_keys = [getattr(obj, field) for obj in children]
             conflicts = {}
-            for obj in manager.filter(parent=merge_node, name__in=child_names):
-                conflicts[obj.name] = obj
+            for obj in manager.filter(parent=merge_node,
+                    **{"%s__in" % field: child_keys}):
+                conflicts[getattr(obj, field)] = obj
             for child in children:
-                if child.name in conflicts:
-                    squash.append((child.id, conflicts[child.name].id))
-                    examine.append((child, conflicts[child.name]))
+                key = getattr(child, field)
+                if key in conflicts:
+                    squash.append((child.id, conflicts[key].id))
+                    examine.append((child, conflicts[key]))
                 else:
                     to_move.append((child, merge_node))
         if squash:
@@ -95,12 +159,90 @@ class AbstractTopic(models.Model):
 
         if to_move:
             signals.pre_move.send(sender=self, moving=to_move)
-            for child, new_parent in to_move:
-                # Need to refresh the instance, as previous moves might have
-                # changed the "lft" and "rght" attributes.
-                new_parent = manager.get(id=new_parent.id)
-                child.move_to(new_parent)
-        self.delete()
+
+        def merge():
+            # Only the parent links are changed as the children are moved and
+            # this node is deleted (bypassing mptt's gap closing). The nested
+            # set values are then fixed up for all the trees involved at once.
+            tree_ids = set([self.tree_id] + [new_parent.tree_id
+                    for _, new_parent in to_move])
+            nestedset.reparent(self.__class__, [(child.id, new_parent.id)
+                    for child, new_parent in to_move], db)
+            # Deleting through a queryset on 'db' collects the cascade from
+            # that database. An instance loaded from a replica would collect
+            # it from the replica, which still has the moved children.
+            manager.filter(pk=self.pk).delete()
+            nestedset.renumber(self.__class__, tree_ids, db)
+        transaction.commit_on_success(using=db)(merge)()
+
+class CollatedTopic(AbstractTopic):
+    """
+    A topic that also stores a sort key for its name (see acacia.collation),
+    so that siblings can be kept in a proper alphabetical order, whatever the
+    database's collation. Register subclasses with
+    order_insertion_by=["sort_key", "name"] to have mptt keep children in
+    that order.
+
+    The sort key is updated whenever the node is saved. If that changes it,
+    the node's tree is renumbered so that the node moves to its new place
+    amongst its siblings. (Root nodes keep their position.)
+    """
+    sort_key = models.CharField(max_length=collation.SORT_KEY_LENGTH,
+            db_index=True, editable=False)
+
+    class Meta(AbstractTopic.Meta):
+        # pylint: disable-msg=W0232
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # The key has to be set before mptt's pre_save handler uses it to
+        # position a new or moved node.
+        key = collation.sort_key(self.name)
+        resort = (self.pk is not None and key != self.sort_key and
+                self.sort_key and self._meta.order_insertion_by)
+        self.sort_key = key
+        super(CollatedTopic, self).save(*args, **kwargs)
+        if resort:
+            self._resort()
+
+    def _resort(self):
+        # pylint: disable-msg=W0212
+        opts = self._meta
+        db = self._state.db
+        tree_id = getattr(self, opts.tree_id_attr)
+        transaction.commit_on_success(using=db)(nestedset.renumber)(
+                self.__class__, [tree_id], db)
+        attrs = [opts.left_attr, opts.right_attr, opts.level_attr]
+        values = self.__class__._default_manager.db_manager(db).filter(
+                pk=self.pk).values_list(*attrs)[0]
+        for attr, value in zip(attrs, values):
+            setattr(self, attr, value)
+
+class NormalisedTopic(AbstractTopic):
+    """
+    A topic that also stores a case folded, NFC normalised form of its name
+    (see acacia.collation.lookup_key()). Names that are the same in that form
+    can't be used for siblings, and get_by_full_name() and
+    get_or_create_by_full_name() match against it, so "Animal/CAT", "animal/cat"
+    and decomposed Unicode variants all find the same topic, using the index.
+    """
+    name_key = models.CharField(max_length=100, editable=False)
+
+    lookup_field = "name_key"
+    index_together = AbstractTopic.index_together + [("level", "name_key")]
+
+    class Meta(AbstractTopic.Meta):
+        # pylint: disable-msg=W0232
+        abstract = True
+        unique_together = [("name", "parent"), ("name_key", "parent")]
+
+    @classmethod
+    def lookup_key(cls, name):
+        return collation.lookup_key(name)
+
+    def save(self, *args, **kwargs):
+        self.name_key = self.lookup_key(self.name)
+        super(NormalisedTopic, self).save(*args, **kwargs)
 
 class Topic(AbstractTopic):
     """
@@ -109,5 +251,44 @@ class Topic(AbstractTopic):
     """
     pass
 
+def _move_node(node, target, position="first-child"):
+    """
+    Moves 'node' with mptt and then sends tree_changed for the trees it was
+    moved between, so that anything depending on the tree's version sees the
+    finished move.
+    """
+    # pylint: disable-msg=W0212
+    tree_attr = node._meta.tree_id_attr
+    tree_ids = set([getattr(node, tree_attr)])
+    node._tree_manager.move_node(node, target, position)
+    tree_ids.add(getattr(node, tree_attr))
+    signals.tree_changed.send(sender=node.__class__, tree_ids=tree_ids)
+
+def track_moves(model):
+    """
+    Makes move_to() on 'model' send tree_changed once the move is done, so
+    that snapshots and cached lookups notice moves made with mptt's API. Call
+    this after registering a topic model with mptt (which replaces
+    move_to()). Topic is already set up.
+    """
+    model.move_to = _move_node
+
 mptt.register(Topic, order_insertion_by=["name"])
+track_moves(Topic)
+
+
+def handle_tree_change(sender, **kwargs):
+    """
+    Makes any snapshots of the sender's trees stale.
+    """
+    # pylint: disable-msg=W0613
+    sender = signals.sender_class(sender)
+    if issubclass(sender, AbstractTopic):
+        snapshot.bump_version(sender)
 
+model_signals.post_syncdb.connect(indexes.create_indexes)
+model_signals.post_save.connect(handle_tree_change)
+model_signals.post_delete.connect(handle_tree_change)
+signals.pre_move.connect(handle_tree_change)
+signals.pre_merge.connect(handle_tree_change)
+signals.tree_changed.connect(handle_tree_change)
@@ -0,0 +1,210 @@
+"""
+Recomputing mptt's nested set columns directly from the parent links.
+
+mptt keeps the left, right, level and tree id values up to date one change at
+a time, shifting large parts of the table for every insert or move. When many
+changes are made together, it is much cheaper to update only the parent links
+and then renumber each affected tree once, which is what renumber() does.
+"""
+
+from django.db import connections, router, transaction
+from mptt.exceptions import InvalidMove
+
+from acacia import signals
+
+__all__ = ["PLACEHOLDER_TREE_ID", "check_moves", "reparent", "renumber"]
+
+# Tree id given to nodes that have been inserted without their nested set
+# values (mptt's own tree ids start at 1). Nodes with this tree id are
+# included whenever a renumber() is done.
+PLACEHOLDER_TREE_ID = 0
+
+# Maximum number of values passed to a single "IN (...)" query.
+BATCH_SIZE = 500
+
+
+def _tree_attrs(model):
+    opts = model._meta
+    return (opts.parent_attr, opts.left_attr, opts.right_attr,
+            opts.level_attr, opts.tree_id_attr)
+
+def _load(model, tree_ids, db):
+    """
+    Returns a list of (pk, parent_id, left, right, level, tree_id, sort_key)
+    tuples for every node in the given trees.
+    """
+    parent, left, right, level, tree_id = _tree_attrs(model)
+    order = list(model._meta.order_insertion_by or [])
+    fields = [model._meta.pk.name, parent, left, right, level, tree_id]
+    fields.extend(order)
+    manager = model._default_manager.db_manager(db)
+    tree_ids = list(tree_ids)
+    rows = []
+    for start in range(0, len(tree_ids), BATCH_SIZE):
+        batch = tree_ids[start:start + BATCH_SIZE]
+        for row in manager.filter(**{"%s__in" % tree_id: batch}).values_list(
+                *fields):
+            # Siblings are ordered by the order_insertion_by fields (if any)
+            # and then by their current position.
+            rows.append(row[:6] + (tuple(row[6:]) + (row[2],),))
+    return rows
+
+def _next_tree_id(model, db):
+    tree_id = model._meta.tree_id_attr
+    queryset = model._default_manager.db_manager(db).order_by("-%s" % tree_id)
+    try:
+        return queryset.values_list(tree_id, flat=True)[0] + 1
+    except IndexError:
+        return 1
+
+def check_moves(model, moves, using=None):
+    """
+    Checks that the moves in 'moves', a list of (node id, new parent id) pairs
+    (a parent id of None makes the node a root), can all be made together.
+
+    Raises model.DoesNotExist if any of the nodes don't exist and
+    mptt.exceptions.InvalidMove if the moves would make any node a descendant
+    of itself. Otherwise, returns the set of tree ids that the nodes would be
+    moved from and to.
+    """
+    if not moves:
+        return set()
+    db = using or router.db_for_write(model)
+    opts = model._meta
+    manager = model._default_manager.db_manager(db)
+    ids = set([pk for pk, _ in moves] +
+            [parent_id for _, parent_id in moves if parent_id is not None])
+    ids = list(ids)
+    tree_ids = set()
+    for start in range(0, len(ids), BATCH_SIZE):
+        tree_ids.update(manager.filter(pk__in=ids[start:start + BATCH_SIZE])
+                .values_list(opts.tree_id_attr, flat=True))
+
+    parents = {}
+    batches = list(tree_ids)
+    for start in range(0, len(batches), BATCH_SIZE):
+        batch = batches[start:start + BATCH_SIZE]
+        parents.update(manager.filter(**{"%s__in" % opts.tree_id_attr: batch})
+                .values_list(opts.pk.name, opts.parent_attr))
+    for pk, parent_id in moves:
+        if pk not in parents or (parent_id is not None and
+                parent_id not in parents):
+            raise model.DoesNotExist
+        parents[pk] = parent_id
+    for pk, _ in moves:
+        seen = set([pk])
+        ancestor = parents[pk]
+        while ancestor is not None:
+            if ancestor in seen:
+                raise InvalidMove("A node may not be made a descendant of "
+                        "itself.")
+            seen.add(ancestor)
+            ancestor = parents[ancestor]
+    return tree_ids
+
+def reparent(model, moves, using=None):
+    """
+    Changes the parent of each node in 'moves', a list of (node id, new parent
+    id) pairs, without touching the nested set values (or checking the moves
+    are valid). Call renumber() on the trees involved afterwards.
+    """
+    db = using or router.db_for_write(model)
+    parent_attr = model._meta.parent_attr
+    manager = model._default_manager.db_manager(db)
+    new_parents = {}
+    for pk, parent_id in moves:
+        new_parents.setdefault(parent_id, []).append(pk)
+    for parent_id, pks in new_parents.items():
+        for start in range(0, len(pks), BATCH_SIZE):
+            manager.filter(pk__in=pks[start:start + BATCH_SIZE]).update(
+                    **{parent_attr: parent_id})
+
+def renumber(model, tree_ids, using=None):
+    """
+    Recomputes the left, right, level and tree id values for every node in
+    the trees with the given tree ids (plus any placeholder nodes), using only
+    the nodes' parent links, and saves the values that have changed.
+
+    Children are ordered by the model's order_insertion_by fields, falling
+    back to their existing order. A root node keeps its tree id if no other
+    root in the set has a better claim to it (by already being the root of
+    that tree). Other roots are given new tree ids, after all existing trees.
+
+    Every node in the trees must have its parent in the same set of trees.
+    Raises ValueError if not, or if the parent links contain a cycle, without
+    changing anything.
+
+    Sends the tree_changed signal and returns the number of rows that were
+    updated.
+    """
+    db = using or router.db_for_write(model)
+    tree_ids = set(tree_ids)
+    tree_ids.add(PLACEHOLDER_TREE_ID)
+    rows = _load(model, tree_ids, db)
+
+    children = {}
+    roots = []
+    for row in rows:
+        if row[1] is None:
+            roots.append(row)
+        else:
+            children.setdefault(row[1], []).append(row)
+    known = set([row[0] for row in rows])
+    for parent_id in children:
+        if parent_id not in known:
+            raise ValueError("Node %s is not in the trees being renumbered, "
+                    "but has children in them." % parent_id)
+
+    # Existing roots (left value of 1) get first claim on their tree ids.
+    roots.sort(key=lambda row: (row[2] != 1, row[5], row[2]))
+    claimed = set()
+    next_tree_id = None
+    new_values = {}
+    for root in roots:
+        tree_id = root[5]
+        if tree_id == PLACEHOLDER_TREE_ID or tree_id in claimed:
+            if next_tree_id is None:
+                next_tree_id = _next_tree_id(model, db)
+            tree_id = next_tree_id
+            next_tree_id += 1
+        claimed.add(tree_id)
+
+        counter = 1
+        stack = [(root, 0, False)]
+        while stack:
+            row, level, finished = stack.pop()
+            if finished:
+                new_values[row[0]][1] = counter
+                counter += 1
+                continue
+            new_values[row[0]] = [counter, None, level, tree_id]
+            counter += 1
+            stack.append((row, level, True))
+            kids = children.get(row[0], [])
+            kids.sort(key=lambda kid: kid[6])
+            kids.reverse()
+            for kid in kids:
+                stack.append((kid, level + 1, False))
+
+    if len(new_values) != len(rows):
+        raise ValueError("The parent links of %d nodes form a cycle." %
+                (len(rows) - len(new_values)))
+
+    updates = []
+    for row in rows:
+        values = new_values[row[0]]
+        if tuple(values) != row[2:6]:
+            updates.append(values + [row[0]])
+    if updates:
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        opts = model._meta
+        columns = [qn(opts.get_field(attr).column)
+                for attr in _tree_attrs(model)[1:]]
+        sql = "UPDATE %s SET %s = %%s, %s = %%s, %s = %%s, %s = %%s " \
+                "WHERE %s = %%s" % tuple([qn(opts.db_table)] + columns +
+                [qn(opts.pk.column)])
+        connection.cursor().executemany(sql, updates)
+        transaction.commit_unless_managed(using=db)
+    signals.tree_changed.send(sender=model, tree_ids=tree_ids)
+    return len(updates)
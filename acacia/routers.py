@@ -0,0 +1,135 @@
+"""
+Database routing for sites that serve topic reads from read replicas.
+
+Add "acacia.routers.TopicReplicaRouter" to DATABASE_ROUTERS to send reads of
+topic models to the databases listed in ACACIA_REPLICA_DATABASES and writes to
+ACACIA_PRIMARY_DATABASE (default "default").
+
+Replicas lag behind the primary, so a topic that has just been created or
+moved may not be visible on them yet. To avoid that, every write to a topic
+(each save or delete, and each move, merge or renumbering of a tree) pins all
+topic reads in the same thread to the primary for ACACIA_STICKY_SECONDS
+seconds (default 5), overriding the database of any instance they start from.
+Routing a query for writing doesn't pin by itself, since lookups that only
+might write (get_or_create_by_full_name(), say) are routed that way too.
+Adding StickyPrimaryMiddleware extends that window across requests from the
+same client, so that the page a client is redirected to after a write is also
+read from the primary.
+"""
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import signals as model_signals
+
+from acacia import signals
+
+__all__ = ["TopicReplicaRouter", "StickyPrimaryMiddleware", "pin_to_primary",
+        "unpin", "is_pinned"]
+
+_state = threading.local()
+
+
+def pin_to_primary(seconds=None):
+    """
+    Sends all topic reads in the current thread to the primary database for
+    the next 'seconds' seconds (default ACACIA_STICKY_SECONDS).
+    """
+    if seconds is None:
+        seconds = getattr(settings, "ACACIA_STICKY_SECONDS", 5)
+    until = time.time() + seconds
+    if until > getattr(_state, "pinned_until", 0):
+        _state.pinned_until = until
+
+def unpin():
+    _state.pinned_until = 0
+
+def is_pinned():
+    return getattr(_state, "pinned_until", 0) > time.time()
+
+def _is_topic_model(model):
+    from acacia.models import AbstractTopic
+    return (issubclass(model, AbstractTopic) or
+            model._meta.app_label in ("acacia", "topicredirects"))
+
+
+class TopicReplicaRouter(object):
+    """
+    Routes topic model reads to a randomly chosen replica (or the primary,
+    when pinned) and writes to the primary. Models that aren't topic models
+    are left to any other routers.
+    """
+    def __init__(self):
+        self.primary = getattr(settings, "ACACIA_PRIMARY_DATABASE", "default")
+        self.replicas = list(getattr(settings, "ACACIA_REPLICA_DATABASES",
+                []))
+
+    def db_for_read(self, model, **hints):
+        if not _is_topic_model(model):
+            return None
+        if not self.replicas or is_pinned():
+            return self.primary
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Keep related lookups on the same database as the instance.
+            return instance._state.db
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        if not _is_topic_model(model):
+            return None
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The primary and replicas all hold the same data.
+        if _is_topic_model(obj1.__class__) and _is_topic_model(obj2.__class__):
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if not _is_topic_model(model):
+            return None
+        return db == self.primary
+
+
+class StickyPrimaryMiddleware(object):
+    """
+    Remembers (in a cookie) that a client has recently caused a topic write,
+    so that the client's next requests also read topics from the primary
+    until the sticky window has passed.
+    """
+    cookie_name = "acacia_primary"
+
+    def process_request(self, request):
+        unpin()
+        try:
+            remaining = float(request.COOKIES[self.cookie_name]) - time.time()
+        except (KeyError, ValueError):
+            return
+        if remaining > 0:
+            pin_to_primary(remaining)
+
+    def process_response(self, request, response):
+        if is_pinned():
+            until = _state.pinned_until
+            response.set_cookie(self.cookie_name, "%.3f" % until,
+                    max_age=int(until - time.time()) + 1)
+        return response
+
+
+def handle_write(sender, **kwargs):
+    """
+    Pins topic reads in the current thread to the primary after a write to a
+    topic model.
+    """
+    # pylint: disable-msg=W0613
+    if _is_topic_model(signals.sender_class(sender)):
+        pin_to_primary()
+
+model_signals.post_save.connect(handle_write)
+model_signals.post_delete.connect(handle_write)
+signals.pre_move.connect(handle_write)
+signals.pre_merge.connect(handle_write)
+signals.tree_changed.connect(handle_write)
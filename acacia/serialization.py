@@ -0,0 +1,99 @@
+"""
+Nested serialisation of topic subtrees.
+
+A subtree is read with a single query, in tree (left value) order, and the
+nesting is rebuilt with a stack as the rows arrive, in the same way as the
+treetrunk template tag builds its nested lists. Rows are read as plain values,
+so no model instances are created.
+"""
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson
+
+__all__ = ["DEFAULT_FIELDS", "nested", "iter_json"]
+
+DEFAULT_FIELDS = ("id", "name")
+
+# Key holding the list of child nodes in each serialised node.
+CHILDREN = "children"
+
+
+def _rows(node, fields, depth):
+    """
+    Returns the fields to output and an iterator over (relative level, values
+    dict) pairs for 'node' and its descendants (down to 'depth' levels below
+    it, if given), in tree order.
+    """
+    # pylint: disable-msg=W0212
+    opts = node._meta
+    fields = list(fields or DEFAULT_FIELDS)
+    level_attr = opts.level_attr
+    filters = {
+        opts.tree_id_attr: getattr(node, opts.tree_id_attr),
+        "%s__gte" % opts.left_attr: getattr(node, opts.left_attr),
+        "%s__lte" % opts.left_attr: getattr(node, opts.right_attr),
+    }
+    base_level = getattr(node, level_attr)
+    if depth is not None:
+        filters["%s__lte" % level_attr] = base_level + depth
+    queryset = node._default_manager.using(node._state.db).filter(**filters)
+    columns = fields + [level_attr]
+    rows = queryset.order_by(opts.left_attr).values(*columns).iterator()
+
+    def generate():
+        for row in rows:
+            level = row[level_attr] - base_level
+            if level_attr not in fields:
+                del row[level_attr]
+            yield level, row
+    return fields, generate()
+
+def nested(node, fields=None, depth=None):
+    """
+    Returns 'node' and its descendants as nested dictionaries. Each contains
+    the values of the named fields (default: DEFAULT_FIELDS) and a "children"
+    list. If 'depth' is given, only that many levels below 'node' are
+    included (0 for just the node itself).
+    """
+    root = None
+    stack = []
+    for level, row in _rows(node, fields, depth)[1]:
+        row[CHILDREN] = []
+        del stack[level:]
+        if stack:
+            stack[-1][CHILDREN].append(row)
+        else:
+            root = row
+        stack.append(row)
+    return root
+
+def iter_json(node, fields=None, depth=None, encoder=DjangoJSONEncoder):
+    """
+    Returns an iterator over pieces of the JSON encoding of nested(node,
+    fields, depth), producing each piece as the rows are read from the
+    database. Only the current node's ancestors are held in memory, so this
+    is suitable for very large subtrees (pass it straight to an
+    HttpResponse, for example).
+    """
+    fields, rows = _rows(node, fields, depth)
+
+    def encode(value):
+        return simplejson.dumps(value, cls=encoder)
+
+    def generate():
+        # The number of nodes still open.
+        open_nodes = 0
+        for level, row in rows:
+            if level < open_nodes:
+                # Close the previous sibling and anything below it.
+                yield "]}" * (open_nodes - level) + ", "
+            open_nodes = level + 1
+            pieces = ["%s: %s" % (encode(field), encode(row[field]))
+                    for field in fields]
+            pieces.append("%s: [" % encode(CHILDREN))
+            yield "{" + ", ".join(pieces)
+        if open_nodes:
+            yield "]}" * open_nodes
+        else:
+            yield "null"
+    return generate()
@@ -6,3 +6,23 @@ pre_merge = dispatch.Signal(providing_args=["merge_pairs"])
 # FIXME: Document!
 pre_move = dispatch.Signal(providing_args=["moving"])
 
+# Sent (with the model class as the sender) after the nested set values of the
+# trees with the given tree ids have been rebuilt, or other changes have been
+# made to topics in bulk, without saving each instance.
+tree_changed = dispatch.Signal(providing_args=["tree_ids"])
+
+# Sent after each instrumented operation completes, when instrumentation is
+# enabled. See acacia.instrumentation.
+operation_timed = dispatch.Signal(providing_args=["operation", "duration",
+        "queries", "rows"])
+
+
+def sender_class(sender):
+    """
+    Returns the model class a signal was sent for. The model signals and
+    tree_changed are sent by the class, but pre_move and pre_merge can be sent
+    by an instance.
+    """
+    if isinstance(sender, type):
+        return sender
+    return sender.__class__
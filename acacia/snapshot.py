@@ -0,0 +1,344 @@
+"""
+Compact, memory-mapped snapshots of topic trees.
+
+When many worker processes start at once, having each of them load the topic
+tree from the database puts a lot of load on it all at the same moment. A
+snapshot is the whole tree (ids, parent links, nested set values and names)
+written to a binary file once, with dump(). Workers open it with
+TreeSnapshot, which maps the file read-only, so every process on a machine
+shares the same pages (via the operating system's page cache) and nothing is
+copied into each process. Full name lookups and ancestor walks run directly
+against the mapped file.
+
+Each snapshot is stamped with the tree's version, a token kept in Django's
+cache that changes whenever a topic is saved or deleted or a tree is
+renumbered. A TreeSnapshot whose stamp doesn't match the current version
+answers from the database instead, until a new snapshot is dumped. Set
+ACACIA_SNAPSHOTS to True to have versions tracked; this needs a cache shared
+by all the processes (not the local memory cache). Without it, snapshots are
+never treated as current.
+
+File layout (all integers little-endian): a header, then one fixed size record
+per node in tree order, then the record numbers sorted by (parent record
+number, lookup name), then the record numbers sorted by primary key, then the
+UTF-8 encoded names.
+"""
+
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+__all__ = ["dump", "TreeSnapshot", "tree_version", "bump_version",
+        "is_enabled"]
+
+MAGIC = "ACTS"
+FORMAT = 1
+
+# Magic, format, (unused), tree version, number of nodes, then the offsets of
+# the records, the child index, the primary key index and the names.
+HEADER = "<4sHH16sIIIII"
+
+# Primary key, parent record number (-1 for roots), left, right, level, tree
+# id, then the offset and length of the name and of the lookup name.
+RECORD = "<qiIIIIIIII"
+
+INDEX_ENTRY = "<I"
+
+# (struct.Struct and unpack_from() would need Python 2.5.)
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD_SIZE = struct.calcsize(RECORD)
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY)
+
+# Versions are kept in the cache for this long after the last change.
+VERSION_TIMEOUT = 30 * 24 * 3600
+
+
+def is_enabled():
+    return getattr(settings, "ACACIA_SNAPSHOTS", False)
+
+def _version_key(model):
+    opts = model._meta
+    return "acacia.snapshot.%s.%s" % (opts.app_label, opts.object_name)
+
+def _new_version():
+    return "%016x" % random.getrandbits(64)
+
+def tree_version(model):
+    """
+    Returns the current version token for the trees of 'model'.
+    """
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def bump_version(model):
+    """
+    Gives the trees of 'model' a new version, making existing snapshots
+    stale. Called automatically whenever a topic is saved or deleted or a
+    tree is renumbered.
+    """
+    if is_enabled():
+        cache.set(_version_key(model), _new_version(), VERSION_TIMEOUT)
+
+def dump(model, path, using=None):
+    """
+    Writes a snapshot of all the trees of 'model' to 'path', replacing any
+    existing file atomically (so processes that have the old file mapped are
+    unaffected). Returns the version the snapshot is stamped with.
+
+    The version is read before the tree, so if the tree changes while the
+    snapshot is being made, the snapshot is already stale when written.
+    """
+    # pylint: disable-msg=R0914
+    db = using or router.db_for_read(model)
+    opts = model._meta
+    version = tree_version(model) or ""
+    fields = [opts.pk.name, opts.parent_attr, "name", opts.left_attr,
+            opts.right_attr, opts.level_attr, opts.tree_id_attr]
+    by_key = model.lookup_field != "name"
+    if by_key:
+        fields.append(model.lookup_field)
+    rows = list(model._default_manager.db_manager(db).order_by(
+            opts.tree_id_attr, opts.left_attr).values_list(*fields))
+
+    positions = dict([(row[0], i) for i, row in enumerate(rows)])
+    names = []
+    names_size = 0
+    name_refs = []
+    keys = []
+    for row in rows:
+        name = row[2].encode("utf-8")
+        refs = [names_size, len(name)]
+        names.append(name)
+        names_size += len(name)
+        key = name
+        if by_key:
+            key = row[7].encode("utf-8")
+            refs.extend([names_size, len(key)])
+            names.append(key)
+            names_size += len(key)
+        else:
+            refs.extend(refs)
+        name_refs.append(refs)
+        keys.append(key)
+
+    records = []
+    parents = []
+    for row, refs in zip(rows, name_refs):
+        parent = positions.get(row[1], -1)
+        parents.append(parent)
+        records.append(struct.pack(RECORD, *([row[0], parent] + list(row[3:7]) +
+                refs)))
+    count = len(rows)
+    child_index = sorted(range(count), key=lambda i: (parents[i], keys[i]))
+    pk_index = sorted(range(count), key=lambda i: rows[i][0])
+
+    records_offset = HEADER_SIZE
+    child_offset = records_offset + count * RECORD_SIZE
+    pk_offset = child_offset + count * INDEX_ENTRY_SIZE
+    names_offset = pk_offset + count * INDEX_ENTRY_SIZE
+    header = struct.pack(HEADER, MAGIC, FORMAT, 0, version, count,
+            records_offset, child_offset, pk_offset, names_offset)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot")
+    try:
+        output = os.fdopen(handle, "wb")
+        try:
+            output.write(header)
+            output.write("".join(records))
+            output.write("".join([struct.pack(INDEX_ENTRY, i)
+                    for i in child_index]))
+            output.write("".join([struct.pack(INDEX_ENTRY, i)
+                    for i in pk_index]))
+            output.write("".join(names))
+        finally:
+            output.close()
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+    return version
+
+
+class TreeSnapshot(object):
+    """
+    Read-only access to a snapshot file written by dump(), for 'model'.
+
+    While the snapshot is current, lookups are answered from the mapped file.
+    Otherwise they go to the database (and the file is reopened if it has been
+    replaced). The version is checked at most once every 'check_interval'
+    seconds; the default of 0 checks it on every lookup, which costs one
+    cache read.
+    """
+    def __init__(self, model, path, check_interval=0):
+        self.model = model
+        self.path = path
+        self.check_interval = check_interval
+        self._map = None
+        self._checked = None
+        self._current = False
+        self._open()
+
+    def _open(self):
+        snapshot_file = open(self.path, "rb")
+        try:
+            stat = os.fstat(snapshot_file.fileno())
+            mapped = mmap.mmap(snapshot_file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        finally:
+            snapshot_file.close()
+        values = struct.unpack(HEADER, mapped[:HEADER_SIZE])
+        if values[0] != MAGIC or values[1] != FORMAT:
+            mapped.close()
+            raise ValueError("%s is not a topic snapshot." % self.path)
+        self.close()
+        self._map = mapped
+        self._file_id = (stat.st_ino, stat.st_mtime, stat.st_size)
+        (self.version, self.count, self._records, self._children, self._pks,
+                self._names) = values[3:]
+        self._checked = None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def is_current(self):
+        """
+        Returns True if the snapshot matches the current version of the
+        trees.
+        """
+        if not is_enabled():
+            return False
+        now = time.time()
+        if (self._checked is not None and
+                now - self._checked < self.check_interval):
+            return self._current
+        version = tree_version(self.model)
+        if version != self.version:
+            try:
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_mtime, stat.st_size) != \
+                        self._file_id:
+                    self._open()
+            except (OSError, IOError, ValueError):
+                pass
+        self._current = version == self.version
+        self._checked = now
+        return self._current
+
+    def _record(self, index):
+        start = self._records + index * RECORD_SIZE
+        return struct.unpack(RECORD, self._map[start:start + RECORD_SIZE])
+
+    def _string(self, offset, length):
+        start = self._names + offset
+        return self._map[start:start + length]
+
+    def _index(self, offset, position):
+        start = offset + position * INDEX_ENTRY_SIZE
+        return struct.unpack(INDEX_ENTRY,
+                self._map[start:start + INDEX_ENTRY_SIZE])[0]
+
+    def _find_child(self, parent, key):
+        """
+        Returns the record number of the child of record 'parent' (or root,
+        for -1) whose lookup name is 'key', or None.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._record(self._index(self._children, middle))
+            if (record[1], self._string(record[8], record[9])) < (parent, key):
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            index = self._index(self._children, low)
+            record = self._record(index)
+            if record[1] == parent and \
+                    self._string(record[8], record[9]) == key:
+                return index
+        return None
+
+    def _find_pk(self, pk):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(self._index(self._pks, middle))[0] < pk:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            index = self._index(self._pks, low)
+            if self._record(index)[0] == pk:
+                return index
+        return None
+
+    def resolve(self, full_name):
+        """
+        Returns the primary key of the topic with the given full name,
+        matched the same way as TopicManager.get_by_full_name().
+
+        Raises model.DoesNotExist if there is no such topic.
+        """
+        if not self.is_current():
+            return self.model._default_manager.get_by_full_name(full_name).pk
+        key = self.model.lookup_key
+        index = -1
+        for piece in full_name.split(self.model.separator):
+            if not piece:
+                continue
+            index = self._find_child(index, key(piece).encode("utf-8"))
+            if index is None:
+                raise self.model.DoesNotExist
+        if index == -1:
+            raise self.model.DoesNotExist
+        return self._record(index)[0]
+
+    def ancestors(self, pk, include_self=False):
+        """
+        Returns a list of (primary key, name) pairs for the ancestors of the
+        topic with primary key 'pk', starting at the root.
+
+        Raises model.DoesNotExist if there is no such topic.
+        """
+        if not self.is_current():
+            node = self.model._default_manager.get(pk=pk)
+            result = list(node.get_ancestors().using(node._state.db)
+                    .values_list("pk", "name"))
+            if include_self:
+                result.append((node.pk, node.name))
+            return result
+        index = self._find_pk(pk)
+        if index is None:
+            raise self.model.DoesNotExist
+        result = []
+        record = self._record(index)
+        if not include_self:
+            index = record[1]
+        while index != -1:
+            record = self._record(index)
+            result.append((record[0],
+                    self._string(record[6], record[7]).decode("utf-8")))
+            index = record[1]
+        result.reverse()
+        return result
+
+    def full_name(self, pk):
+        """
+        Returns the full name of the topic with primary key 'pk'.
+        """
+        names = [name for _, name in self.ancestors(pk, True)]
+        return self.model.separator.join(names)
@@ -0,0 +1,301 @@
+"""
+Bringing a topic tree into line with a desired set of full names.
+
+The differences between the current tree and the desired one are worked out
+in memory, from a single query. Names are compared by the model's lookup key,
+so for a model that normalises names, a desired name that only differs from an
+existing one in case (say) matches the existing node, which is left as it is.
+Wherever possible, existing nodes are moved (keeping their primary keys and so
+any foreign keys pointing at them) rather than being deleted and recreated.
+All the changes are then made in one transaction, updating only the parent
+links, followed by a single renumbering of the affected trees.
+"""
+
+from django.db import router, transaction
+
+from acacia import nestedset, signals
+
+__all__ = ["SyncPlan"]
+
+
+class SyncPlan(object):
+    """
+    The changes needed to make a topic tree match a desired set of full
+    names. Create one with TopicManager.sync().
+
+    The changes are available as follows. Existing nodes are named as they
+    are before any changes are made, so that the plan can be read against the
+    current tree; new names are those in the desired tree.
+
+        creates: full names of the nodes to create, parents first.
+        moves: (node id, old full name, new full name) triples.
+        merges: (node id, old full name, surviving node id, surviving full
+            name) tuples, for nodes that are removed after their children have
+            been moved to an existing node of the same name.
+        deletes: (node id, full name, number of descendants) triples, for the
+            roots of the subtrees that are deleted outright.
+    """
+    def __init__(self, manager, spec):
+        # pylint: disable-msg=W0212
+        self.model = manager.model
+        self.db = manager._db or router.db_for_write(self.model)
+        self.separator = self.model.separator
+        self.creates = []
+        self.moves = []
+        self.merges = []
+        self.deletes = []
+        self._plan(manager.db_manager(self.db), spec)
+
+    def __nonzero__(self):
+        return bool(self.creates or self.moves or self.merges or
+                self.deletes)
+
+    def __unicode__(self):
+        return u"\n".join(self.describe())
+
+    def describe(self):
+        """
+        Returns a list of lines describing the planned changes.
+        """
+        lines = []
+        for name in self.creates:
+            lines.append(u"create  %s" % name)
+        for _, old_name, new_name in self.moves:
+            lines.append(u"move    %s -> %s" % (old_name, new_name))
+        for _, old_name, _, new_name in self.merges:
+            lines.append(u"merge   %s -> %s" % (old_name, new_name))
+        for _, name, count in self.deletes:
+            if count:
+                lines.append(u"delete  %s (and %d descendants)" % (name,
+                        count))
+            else:
+                lines.append(u"delete  %s" % name)
+        return lines
+
+    def _split(self, full_name):
+        return [piece for piece in full_name.split(self.separator) if piece]
+
+    def _join(self, prefix, relative_name):
+        if not relative_name:
+            return prefix
+        if not prefix:
+            return relative_name
+        return u"%s%s%s" % (prefix, self.separator, relative_name)
+
+    def _parent_name(self, full_name):
+        return self.separator.join(self._split(full_name)[:-1])
+
+    def _plan(self, manager, spec):
+        # pylint: disable-msg=R0912,R0914,R0915
+        # Nodes are matched on the model's lookup keys (the exact names,
+        # unless the model normalises them), so the "paths" here are full
+        # names made of keys. Names for display are kept alongside.
+        lookup_key = self.model.lookup_key
+        desired = set()
+        shown = {}
+        for full_name in spec:
+            pieces = self._split(full_name)
+            keys = [lookup_key(piece) for piece in pieces]
+            for i in range(1, len(pieces) + 1):
+                path = self.separator.join(keys[:i])
+                desired.add(path)
+                shown.setdefault(path, self.separator.join(pieces[:i]))
+
+        parents = {}
+        names = {}
+        keys = {}
+        self._tree_ids = {}
+        for pk, parent_id, name, tree_id in manager.values_list("id",
+                "parent", "name", self.model._meta.tree_id_attr):
+            parents[pk] = parent_id
+            names[pk] = name
+            keys[pk] = lookup_key(name)
+            self._tree_ids[pk] = tree_id
+        children = {}
+        for pk, parent_id in parents.items():
+            children.setdefault(parent_id, []).append(pk)
+
+        # Paths, full names and depths of existing nodes, from the roots
+        # down.
+        current = {}
+        current_names = {}
+        depth = {}
+        pending = [(pk, 0) for pk in children.get(None, [])]
+        while pending:
+            pk, level = pending.pop()
+            current[pk] = self._join(current.get(parents[pk], u""), keys[pk])
+            current_names[pk] = self._join(current_names.get(parents[pk],
+                    u""), names[pk])
+            depth[pk] = level
+            pending.extend([(kid, level + 1) for kid in children.get(pk, [])])
+        existing = dict([(path, pk) for pk, path in current.items()])
+
+        to_delete = set([pk for pk, path in current.items()
+                if path not in desired])
+        to_create = set([path for path in desired if path not in existing])
+        by_leaf = {}
+        for path in to_create:
+            by_leaf.setdefault(self._split(path)[-1], set()).add(path)
+
+        def subtree(root):
+            """
+            Returns (id, relative path, relative name) triples for 'root' and
+            its descendants.
+            """
+            result = []
+            stack = [(root, u"", u"")]
+            while stack:
+                pk, rel, rel_name = stack.pop()
+                result.append((pk, rel, rel_name))
+                for kid in children.get(pk, []):
+                    stack.append((kid, self._join(rel, keys[kid]),
+                            self._join(rel_name, names[kid])))
+            return result
+
+        # Moves: each node that would otherwise be deleted is moved to the
+        # place in the desired tree that reuses the most nodes from its
+        # subtree. Working from the top down finds the largest moves first.
+        planned = dict(current)
+        planned_names = dict(current_names)
+        moved = {}
+        for pk in sorted(to_delete, key=lambda pk: (depth[pk], current[pk])):
+            if pk not in to_delete or keys[pk] not in by_leaf:
+                continue
+            nodes = subtree(pk)
+            own_prefix = planned[pk] + self.separator
+            best = None
+            for target in by_leaf[keys[pk]]:
+                parent_path = self._parent_name(target)
+                if (parent_path + self.separator).startswith(own_prefix):
+                    # Can't move a node underneath itself.
+                    continue
+                new_paths = [self._join(target, rel) for _, rel, _ in nodes]
+                if [1 for path in new_paths
+                        if path in desired and path not in to_create]:
+                    # Part of the subtree would land on a node that will
+                    # already be there.
+                    continue
+                score = len([1 for path in new_paths if path in to_create])
+                key = (score, -len(target), target)
+                if best is None or key > best:
+                    best = key
+            if best is None:
+                continue
+            target = best[2]
+            self.moves.append((pk, current_names[pk], shown[target]))
+            moved[pk] = self._parent_name(target)
+            for node, rel, rel_name in nodes:
+                planned[node] = self._join(target, rel)
+                planned_names[node] = self._join(shown[target], rel_name)
+                if planned[node] in to_create:
+                    to_create.remove(planned[node])
+                    by_leaf[keys[node]].remove(planned[node])
+                    to_delete.discard(node)
+
+        # A deleted node whose children were moved to an existing node with
+        # the same name has been merged into that node.
+        merged = {}
+        for pk, parent_path in moved.items():
+            old_parent = parents[pk]
+            new_parent = existing.get(parent_path)
+            if (old_parent in to_delete and new_parent is not None and
+                    new_parent not in to_delete and
+                    keys[old_parent] == keys[new_parent]):
+                merged[old_parent] = new_parent
+        for old_id, new_id in merged.items():
+            self.merges.append((old_id, current_names[old_id], new_id,
+                    planned_names[new_id]))
+        self.merges.sort(key=lambda merge: merge[1])
+
+        for pk in to_delete:
+            if pk not in merged and (parents[pk] not in to_delete or
+                    parents[pk] in merged):
+                count = len([1 for node, _, _ in subtree(pk)
+                        if node in to_delete]) - 1
+                self.deletes.append((pk, current_names[pk], count))
+        self.deletes.sort(key=lambda delete: delete[1])
+        self._creates = sorted(to_create,
+                key=lambda path: (len(self._split(path)), shown[path]))
+        self.creates = [shown[path] for path in self._creates]
+
+        self._to_delete = to_delete
+        self._moved = moved
+        self._planned = planned
+        self._planned_names = planned_names
+
+    def apply(self):
+        """
+        Makes the planned changes in a single transaction.
+        """
+        if self:
+            transaction.commit_on_success(using=self.db)(self._apply)()
+
+    def _apply(self):
+        # pylint: disable-msg=W0201,W0212
+        model = self.model
+        manager = model._default_manager.db_manager(self.db)
+        opts = model._meta
+        tree_attr = opts.tree_id_attr
+        ids = dict([(path, pk) for pk, path in self._planned.items()
+                if pk not in self._to_delete])
+        final_names = dict([(pk, name) for pk, name in
+                self._planned_names.items() if pk not in self._to_delete])
+        affected = set()
+
+        # New nodes are inserted with placeholder tree values, so that mptt
+        # leaves them alone until the renumbering at the end.
+        created = {}
+        for path, name in zip(self._creates, self.creates):
+            node = model(name=self._split(name)[-1],
+                    parent_id=ids.get(self._parent_name(path)))
+            setattr(node, opts.left_attr, 1)
+            setattr(node, opts.right_attr, 2)
+            setattr(node, opts.level_attr, 0)
+            setattr(node, tree_attr, nestedset.PLACEHOLDER_TREE_ID)
+            node.save(using=self.db)
+            ids[path] = node.pk
+            final_names[node.pk] = name
+            created[node.pk] = node
+            if node.parent_id in self._tree_ids:
+                affected.add(self._tree_ids[node.parent_id])
+
+        instances = manager.in_bulk([pk for pk in self._moved] +
+                [merge[0] for merge in self.merges])
+        for old_id, _, new_id, _ in self.merges:
+            signals.pre_merge.send(sender=instances[old_id],
+                    merge_pairs=[(old_id, new_id)])
+        if self._moved:
+            parent_ids = set([ids[name] for name in self._moved.values()
+                    if name])
+            parents = manager.in_bulk([pk for pk in parent_ids
+                    if pk not in created])
+            parents.update(created)
+            for parent in parents.values():
+                # Receivers should see the names the parents will end up
+                # with, not their current ones.
+                parent._full_name_cache = final_names[parent.pk]
+                parent._cached_parent = parent.parent_id
+            moving = []
+            for pk, _, _ in self.moves:
+                parent_name = self._moved[pk]
+                if parent_name:
+                    moving.append((instances[pk], parents[ids[parent_name]]))
+                else:
+                    moving.append((instances[pk], None))
+            signals.pre_move.send(sender=model, moving=moving)
+
+        nestedset.reparent(model, [(pk, ids.get(self._moved[pk]))
+                for pk, _, _ in self.moves], self.db)
+        for pk, _, _ in self.moves:
+            parent_id = ids.get(self._moved[pk])
+            affected.add(self._tree_ids[pk])
+            if parent_id in self._tree_ids:
+                affected.add(self._tree_ids[parent_id])
+
+        to_delete = list(self._to_delete)
+        for start in range(0, len(to_delete), nestedset.BATCH_SIZE):
+            batch = to_delete[start:start + nestedset.BATCH_SIZE]
+            manager.filter(pk__in=batch).delete()
+        affected.update([self._tree_ids[pk] for pk in to_delete])
+
+        nestedset.renumber(model, affected, self.db)
@@ -1,27 +1,62 @@
 from django import template
+from django.conf import settings
 from django.db import models
+from django.utils.encoding import iri_to_uri
 from django.utils.html import escape
+from django.utils.importlib import import_module
+from django.utils.safestring import mark_safe
+
+# This module is itself called "acacia", so "from acacia import ..." would
+# import from it (before Python 2.5's absolute_import, anyway).
+instrumented = import_module("acacia.instrumentation").instrumented
 
 register = template.Library()
 
-class TreeTrunkNode(template.Node):
+class TopicModelNode(template.Node):
     """
-    Render the first few levels of a topic tree as an unordered HTML list.
+    Base class for nodes that display a topic model named by an
+    "app_label.ModelName" argument. The model is only looked up when the
+    template is first rendered, so that parsing templates doesn't force the
+    applications to be loaded.
     """
     def __init__(self, model_name, levels=2):
-        super(TreeTrunkNode, self).__init__()
-        app_name, model_name = model_name.rsplit(".", 1)
-        self.model = models.get_model(app_name, model_name)
-        if self.model is None:
-            raise template.TemplateSyntaxError("Bad app or model name: %s" %
-                    model_name)
+        super(TopicModelNode, self).__init__()
+        if "." not in model_name:
+            raise template.TemplateSyntaxError("Model must be given as "
+                    "app_label.ModelName, not '%s'." % model_name)
+        self.model_name = model_name
         self.levels = levels
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            app_name, model_name = self.model_name.rsplit(".", 1)
+            model = models.get_model(app_name, model_name)
+            if model is None:
+                raise template.TemplateSyntaxError("Bad app or model name: %s"
+                        % self.model_name)
+            self._model = model
+        return self._model
+    model = property(_get_model)
+
+    def get_nodes(self):
+        """
+        Returns the nodes in the first self.levels levels, in tree order.
+        """
+        # Equality tests on the level let the database use the level index,
+        # where "level < N" can end up scanning the whole tree in order.
+        return self.model.tree.filter(level__in=range(self.levels))
 
+class TreeTrunkNode(TopicModelNode):
+    """
+    Render the first few levels of a topic tree as an unordered HTML list.
+    """
+    @instrumented("treetrunk")
     def render(self, context):
         current_level = 0
         pieces = [u"<ul>"]
         first = True
-        for node in self.model.tree.filter(level__lt=self.levels):
+        for node in self.get_nodes():
             diff = node.level - current_level
             if diff == 0:
                 if first:
@@ -48,12 +83,52 @@ class TreeTrunkNode(template.Node):
         return u"\n".join(pieces)
 
 
-@register.tag
-def treetrunk(dummy, token):
+class TopicTreeNode(TopicModelNode):
     """
-    Called as {% treetops app.SomeModel N %} to display the first N levels of
-    the Topic-derived tree class, SomeModel. The number of levels (N) can be
-    omitted and defaults to 2 (root nodes and their children).
+    Render the first few levels of a topic tree using a template fragment for
+    each node. The fragment is parsed once, with the rest of the template,
+    and rendered for every node, with "node" set to the topic and "children"
+    to the already rendered output for its children.
+    """
+    def __init__(self, model_name, levels, nodelist):
+        super(TopicTreeNode, self).__init__(model_name, levels)
+        self.nodelist = nodelist
+
+    def render_node(self, context, node, children):
+        context.push()
+        try:
+            context["node"] = node
+            context["children"] = mark_safe(u"".join(children))
+            return self.nodelist.render(context)
+        finally:
+            context.pop()
+
+    @instrumented("topictree")
+    def render(self, context):
+        # Each entry is (level, node, rendered children).
+        stack = []
+        output = []
+
+        def close(entry):
+            rendered = self.render_node(context, entry[1], entry[2])
+            if stack:
+                stack[-1][2].append(rendered)
+            else:
+                output.append(rendered)
+
+        for node in self.get_nodes():
+            while stack and stack[-1][0] >= node.level:
+                close(stack.pop())
+            stack.append((node.level, node, []))
+        while stack:
+            close(stack.pop())
+        return u"".join(output)
+
+
+def parse_tree_arguments(token):
+    """
+    Returns the model name and number of levels from the arguments of a
+    treetrunk or topictree tag.
     """
     bits = token.split_contents()
     if len(bits) == 3:
@@ -69,5 +144,92 @@ def treetrunk(dummy, token):
     else:
         raise template.TemplateSyntaxError("Invalid number of arguments (%d, "
                 "expected 1 or 2)." % (len(bits) - 1))
-    return TreeTrunkNode(bits[1], level)
+    return bits[1], level
+
+@register.tag
+def treetrunk(dummy, token):
+    """
+    Called as {% treetops app.SomeModel N %} to display the first N levels of
+    the Topic-derived tree class, SomeModel. The number of levels (N) can be
+    omitted and defaults to 2 (root nodes and their children).
+    """
+    return TreeTrunkNode(*parse_tree_arguments(token))
+
+@register.tag
+def topictree(parser, token):
+    """
+    Called as
+
+        {% topictree app.SomeModel N %}
+            <li>{{ node.name }}
+            {% if children %}<ul>{{ children }}</ul>{% endif %}</li>
+        {% endtopictree %}
+
+    to display the first N levels of the Topic-derived tree class, SomeModel,
+    with custom markup. The contents are rendered for each node, with "node"
+    set to the topic and "children" to the rendered output for its children.
+    As with treetrunk, N defaults to 2.
+    """
+    model_name, levels = parse_tree_arguments(token)
+    nodelist = parser.parse(("endtopictree",))
+    parser.delete_first_token()
+    return TopicTreeNode(model_name, levels, nodelist)
+
+
+class BreadcrumbsNode(template.Node):
+    """
+    Render the path to a topic as links to each of its ancestors, followed
+    by the topic's name.
+    """
+    def __init__(self, topic, prefix=None):
+        super(BreadcrumbsNode, self).__init__()
+        self.topic = topic
+        self.prefix = prefix
+
+    def render(self, context):
+        topic = self.topic.resolve(context)
+        if not topic:
+            return u""
+        if self.prefix is not None:
+            prefix = self.prefix.resolve(context)
+        else:
+            prefix = getattr(settings, "ACACIA_TOPIC_URL_PREFIX", "/")
+        path = topic.ancestor_path()
+        pieces = []
+        for node in path[:-1]:
+            url = iri_to_uri(u"%s%s/" % (prefix, node.full_name()))
+            pieces.append(u'<a href="%s">%s</a>' % (escape(url),
+                    escape(node.name)))
+        pieces.append(escape(topic.name))
+        return (u" %s " % escape(topic.separator)).join(pieces)
+
+
+@register.tag
+def breadcrumbs(parser, token):
+    """
+    Called as {% breadcrumbs topic %} or {% breadcrumbs topic "/prefix/" %}
+    to display the path to 'topic', with a link for each ancestor. The links
+    are the prefix (default: the ACACIA_TOPIC_URL_PREFIX setting, or "/")
+    followed by the ancestor's full name and a slash.
+
+    Use TopicManager.prefetch_ancestors() in the view to load the paths for
+    a whole page of topics with one query.
+    """
+    bits = token.split_contents()
+    if len(bits) not in (2, 3):
+        raise template.TemplateSyntaxError("Invalid number of arguments (%d, "
+                "expected 1 or 2)." % (len(bits) - 1))
+    prefix = None
+    if len(bits) == 3:
+        prefix = parser.compile_filter(bits[2])
+    return BreadcrumbsNode(parser.compile_filter(bits[1]), prefix)
 
+@register.filter
+def ancestor_path(topic):
+    """
+    Returns the list of a topic's ancestors, starting at the root, followed by
+    the topic itself, for use as in {% for node in topic|ancestor_path %}.
+    """
+    if not topic:
+        return []
+    return topic.ancestor_path()
@@ -1,4 +1,17 @@
 from acacia.tests.test_models import TopicTest
 from acacia.tests.test_templatetags import (TreeTrunkErrorTests,
-        TreeTrunkMiscTests, TreeTrunkSingleRootTests, TreeTrunkFullContentTests)
+        TreeTrunkMiscTests, TreeTrunkSingleRootTests, TreeTrunkFullContentTests,
+        TopicTreeTests, BreadcrumbTests)
 
+from acacia.tests.test_redirects import RedirectTest
+from acacia.tests.test_instrumentation import InstrumentationTest
+from acacia.tests.test_routing import (MultipleDatabaseTest, ReplicaRouterTest,
+        ReplicaMergeTest)
+from acacia.tests.test_sync import SyncTest
+from acacia.tests.test_integrity import IntegrityTest
+from acacia.tests.test_collation import CollationTest
+from acacia.tests.test_lookup import NormalisedLookupTest
+from acacia.tests.test_snapshot import SnapshotTest
+from acacia.tests.test_serialization import SerializationTest
+from acacia.tests.test_indexes import IndexTest
+from acacia.tests.test_views import ViewTest
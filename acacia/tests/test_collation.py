@@ -0,0 +1,74 @@
+"""
+Tests for ordering topics by stored sort keys.
+"""
+from django import template, test
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from acacia import collation
+from sampletopics.models import SortedTopic
+
+NAMES = [u"zoo", u"\xc4pfel", u"apple", u"Banana", u"\xe9cole", u"ecureuil"]
+
+def code_point_key(name):
+    return name
+
+
+class CollationTest(test.TestCase):
+    def setUp(self):
+        collation._collation = None
+        self.root = SortedTopic.objects.create(name=u"root")
+        for name in NAMES:
+            # mptt needs an up to date parent each time.
+            parent = SortedTopic.objects.get(pk=self.root.pk)
+            SortedTopic.objects.create(name=name, parent=parent)
+
+    def tearDown(self):
+        if hasattr(settings, "ACACIA_COLLATION"):
+            del settings.ACACIA_COLLATION
+        collation._collation = None
+
+    def children(self):
+        return [node.name for node in
+                SortedTopic.objects.get(pk=self.root.pk).get_children()]
+
+    def test_default_key(self):
+        self.assertEqual(collation.sort_key(u"\xc9cole"),
+                collation.sort_key(u"ecole"))
+        # Composed and decomposed forms give the same key.
+        self.assertEqual(collation.sort_key(u"\xe9cole"),
+                collation.sort_key(u"e\u0301cole"))
+        self.failUnless(collation.sort_key(u"\xe9cole") <
+                collation.sort_key(u"ecureuil") < collation.sort_key(u"zoo"))
+
+    def test_children_order(self):
+        self.assertEqual(self.children(), [u"\xc4pfel", u"apple", u"Banana",
+                u"\xe9cole", u"ecureuil", u"zoo"])
+
+    def test_treetrunk(self):
+        tmpl = template.Template("{% load acacia %}"
+                "{% treetrunk sampletopics.SortedTopic %}")
+        output = tmpl.render(template.Context())
+        positions = [output.index(name) for name in self.children()]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_rename(self):
+        node = SortedTopic.objects.get(name=u"zoo")
+        node.name = u"aardvark"
+        node.save()
+        self.assertEqual(self.children()[0], u"aardvark")
+        self.assertEqual(node.lft, self.root.lft + 1)
+
+    def test_refresh(self):
+        settings.ACACIA_COLLATION = "acacia.tests.test_collation.code_point_key"
+        collation._collation = None
+        # Lower case ASCII names have the same key either way.
+        self.assertEqual(collation.refresh_sort_keys(SortedTopic), 3)
+        self.assertEqual(self.children(), [u"Banana", u"apple", u"ecureuil",
+                u"zoo", u"\xc4pfel", u"\xe9cole"])
+        self.assertEqual(collation.refresh_sort_keys(SortedTopic), 0)
+
+    def test_bad_setting(self):
+        settings.ACACIA_COLLATION = "acacia.tests.test_collation.missing_key"
+        collation._collation = None
+        self.assertRaises(ImproperlyConfigured, collation.get_collation)
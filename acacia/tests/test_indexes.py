@@ -0,0 +1,87 @@
+"""
+Tests that the queries Acacia makes are served by indexes.
+"""
+import re
+
+from django import db, template, test
+
+from acacia import indexes, models
+from acacia.tests.test_models import BaseTestSetup
+
+# A line of SQLite's query plan output for a scan through every row of a
+# table, whether directly or in the order of one of its indexes.
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(\w+)")
+
+
+class RecordingCursor(object):
+    """
+    Records every SELECT statement, with its parameters.
+    """
+    def __init__(self, cursor, log):
+        self.cursor = cursor
+        self.log = log
+
+    def execute(self, sql, params=()):
+        if sql.lstrip().upper().startswith("SELECT"):
+            self.log.append((sql, tuple(params)))
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+
+class IndexTest(BaseTestSetup, test.TransactionTestCase):
+    # Python's sqlite3 module commits before running EXPLAIN, which would end
+    # a TestCase's transaction.
+
+    def record(self, func, *args):
+        log = []
+        connection = db.connection
+        original = connection.cursor
+        connection.cursor = lambda: RecordingCursor(original(), log)
+        try:
+            func(*args)
+        finally:
+            del connection.cursor
+        self.failUnless(log)
+        return log
+
+    def full_scans(self, queries):
+        cursor = db.connection.cursor()
+        scans = []
+        for sql, params in queries:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            for row in cursor.fetchall():
+                match = FULL_SCAN.match(row[-1])
+                if match and match.group(2).startswith("acacia_"):
+                    scans.append((sql, row[-1]))
+        return scans
+
+    def test_indexes_created(self):
+        cursor = db.connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = 'acacia_topic'")
+        names = set([row[0] for row in cursor.fetchall()])
+        self.failUnless("acacia_topic_level_name" in names)
+        self.failUnless("acacia_topic_tree_id_lft_rght" in names)
+        self.assertEqual(indexes.sql_for_model(models.Topic, db.connection)[0],
+                'CREATE INDEX "acacia_topic_level_name" ON "acacia_topic" '
+                '("level", "name");')
+
+    def test_query_plans(self):
+        manager = models.Topic.objects
+        node = manager.get_by_full_name("a/b/c")
+        operations = [
+            (manager.get_by_full_name, "x/y/c"),
+            (lambda name: list(manager.get_subtree(name)), "a"),
+            (lambda name: manager.get_by_full_name(name).full_name(), "c/b/d"),
+            (manager.get_or_create_by_full_name, "a/x/c"),
+            (lambda node: list(node.get_children()), node.parent),
+            (lambda node: list(node.get_ancestors()), node),
+            (lambda node: node.as_nested(), node.parent),
+            (template.Template("{% load acacia %}{% treetrunk acacia.Topic %}"
+                    ).render, template.Context()),
+        ]
+        for operation in operations:
+            queries = self.record(*operation)
+            self.assertEqual(self.full_scans(queries), [])
@@ -0,0 +1,86 @@
+"""
+Tests for the optional operation timing and query counting.
+"""
+from django import template, test
+
+from acacia import instrumentation, models, signals
+from acacia.tests.test_models import BaseTestSetup
+
+
+class InstrumentationTest(BaseTestSetup, test.TestCase):
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        instrumentation.enable()
+        signals.operation_timed.connect(self.signal_catcher)
+
+    def tearDown(self):
+        signals.operation_timed.disconnect(self.signal_catcher)
+        instrumentation.disable()
+        super(InstrumentationTest, self).tearDown()
+
+    def test_disabled(self):
+        """
+        Tests that nothing is reported when instrumentation is turned off.
+        """
+        instrumentation.disable()
+        models.Topic.objects.get_by_full_name("a/b/c")
+        self.assertEqual(self.signals, [])
+
+    def test_counts_queries(self):
+        """
+        Tests that the queries and rows for a call are reported.
+        """
+        models.Topic.objects.get_by_full_name("a/b/c")
+        self.assertEqual(len(self.signals), 1)
+        sender, kwargs = self.signals[0]
+        self.assertEqual(sender, models.Topic)
+        self.assertEqual(kwargs["operation"], "get_by_full_name")
+        # One query for the three candidates, plus one ancestor query (two
+        # rows) for the first candidate, a/b/c, which matches.
+        self.assertEqual(kwargs["queries"], 2)
+        self.assertEqual(kwargs["rows"], 5)
+        self.assert_(kwargs["duration"] >= 0)
+
+    def test_nested_calls(self):
+        """
+        Tests that nested instrumented calls are reported individually and
+        the outer call includes the inner call's queries.
+        """
+        models.Topic.objects.get_or_create_by_full_name("a/b/c")
+        operations = [(kwargs["operation"], kwargs["queries"])
+                for _, kwargs in self.signals]
+        self.assertEqual(operations, [("get_by_full_name", 2),
+                ("get_or_create_by_full_name", 2)])
+
+    def test_write_rows_counted(self):
+        """
+        Tests that rows modified by updates are included in the row count.
+        """
+        node = models.Topic.objects.get_by_full_name("c/b/d")
+        self.signals = []
+        node.merge_to(models.Topic.objects.get_by_full_name("a"))
+        kwargs = [kw for _, kw in self.signals
+                if kw["operation"] == "merge_to"][0]
+        self.assert_(kwargs["queries"] > 0)
+        self.assert_(kwargs["rows"] > 0)
+
+    def test_template_tag(self):
+        compiled = template.Template(
+                "{% load acacia %}{% treetrunk acacia.Topic %}")
+        compiled.render(template.Context({}))
+        self.assertEqual([kwargs["operation"] for _, kwargs in self.signals],
+                ["treetrunk"])
+        self.assertEqual(self.signals[0][0], models.Topic)
+
+    def test_slow_call_logger(self):
+        logger = instrumentation.SlowCallLogger(threshold=1000, keep=2)
+        logger.connect()
+        try:
+            for name in ("a", "a/b", "a/b/c"):
+                models.Topic.objects.get_by_full_name(name)
+        finally:
+            logger.disconnect()
+        slowest = logger.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assert_(slowest[0][0] >= slowest[1][0])
+        self.assertEqual(slowest[0][1:3], ("Topic", "get_by_full_name"))
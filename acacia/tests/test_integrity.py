@@ -0,0 +1,148 @@
+"""
+Tests for checking and repairing the nested set values of topic trees.
+"""
+import os
+import sys
+import tempfile
+from StringIO import StringIO
+
+from django import test
+from django.core import management
+
+from acacia import integrity, models
+from acacia.tests.test_models import BaseTestSetup, check_tree
+from sampletopics.models import FoldedTopic, SortedTopic
+
+
+class IntegrityTest(BaseTestSetup, test.TestCase):
+    def problems(self):
+        return list(integrity.verify(models.Topic))
+
+    def test_clean(self):
+        self.assertEqual(self.problems(), [])
+        self.assertEqual(integrity.repair(models.Topic), [])
+
+    def test_wrong_level(self):
+        node = models.Topic.objects.get_by_full_name("a/b/c")
+        models.Topic.objects.filter(pk=node.pk).update(level=1)
+        problems = self.problems()
+        self.assertEqual(problems, [(node.tree_id, node.pk,
+                "level is 1, expected 2")])
+        self.assertRaises(models.Topic.DoesNotExist,
+                models.Topic.objects.get_by_full_name, "a/b/c")
+
+        self.assertEqual(integrity.repair(models.Topic), [(node.tree_id, 1)])
+        self.assertEqual(self.problems(), [])
+        self.assertEqual(models.Topic.objects.get_by_full_name("a/b/c").pk,
+                node.pk)
+        check_tree(self)
+
+    def test_overlapping_ranges(self):
+        # Simulate a move that stopped after updating the parent link.
+        node = models.Topic.objects.get_by_full_name("a/x")
+        target = models.Topic.objects.get_by_full_name("a/b")
+        models.Topic.objects.filter(pk=node.pk).update(parent=target)
+        self.failUnless(self.problems())
+        integrity.repair(models.Topic)
+        self.assertEqual(self.problems(), [])
+        self.assertEqual(unicode(models.Topic.objects.get(pk=node.pk)),
+                u"a/b/x")
+        check_tree(self)
+
+    def test_parent_in_other_tree(self):
+        # A half-finished move of a subtree into another tree.
+        node = models.Topic.objects.get_by_full_name("c/b")
+        target = models.Topic.objects.get_by_full_name("x")
+        models.Topic.objects.filter(pk=node.pk).update(parent=target)
+        broken = set([tree_id for tree_id, _, _ in self.problems()])
+        self.assertEqual(broken, set([node.tree_id]))
+        integrity.repair(models.Topic)
+        self.assertEqual(self.problems(), [])
+        self.assertEqual(unicode(models.Topic.objects.get(pk=node.pk)),
+                u"x/b")
+        self.assertEqual(models.Topic.objects.get_by_full_name("x/b/d").level,
+                2)
+        check_tree(self)
+
+    def test_duplicate_roots(self):
+        # The database only stops siblings with a parent sharing a name.
+        root = models.Topic.objects.get_by_full_name("x")
+        models.Topic.objects.filter(pk=root.pk).update(name="c")
+        self.assertEqual([pk for _, pk, _ in self.problems()], [root.pk])
+
+    def test_lookup_names(self):
+        """
+        Tests that names are compared as the model looks them up.
+        """
+        FoldedTopic.objects.create(name=u"Cat")
+        root = FoldedTopic.objects.create(name=u"cat")
+        self.assertEqual([pk for _, pk, _ in integrity.verify(FoldedTopic)],
+                [root.pk])
+        # pylint: disable-msg=W0212
+        self.failUnless(integrity._duplicates_adjacent(models.Topic))
+        self.failUnless(integrity._duplicates_adjacent(SortedTopic))
+        self.failIf(integrity._duplicates_adjacent(FoldedTopic))
+
+    def test_cycle(self):
+        node = models.Topic.objects.get_by_full_name("a")
+        child = models.Topic.objects.get_by_full_name("a/b")
+        models.Topic.objects.filter(pk=node.pk).update(parent=child)
+        self.assertEqual(integrity.repair(models.Topic), [(node.tree_id, None)])
+
+    def test_command(self):
+        node = models.Topic.objects.get_by_full_name("a/b/c")
+        models.Topic.objects.filter(pk=node.pk).update(level=5)
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            self.assertRaises(SystemExit, management.call_command,
+                    "checktopics")
+            management.call_command("checktopics", repair=True)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+        self.failUnless("level is 5, expected 2" in output)
+        self.failUnless("1 with problems, 1 rebuilt" in output)
+        self.assertEqual(self.problems(), [])
+
+    def test_process_tree(self):
+        node = models.Topic.objects.get_by_full_name("a/b/c")
+        self.assertEqual(integrity.process_tree(models.Topic, node.tree_id,
+                repair=True), (node.tree_id, [], None))
+        self.assertEqual(integrity.process_tree(models.Topic, node.tree_id,
+                rebuild=True), (node.tree_id, [], 0))
+
+        # Trees linked to other trees are left for a serial repair.
+        target = models.Topic.objects.get_by_full_name("x")
+        models.Topic.objects.filter(pk=node.pk).update(parent=target)
+        tree_id, problems, updated = integrity.process_tree(models.Topic,
+                node.tree_id, repair=True)
+        self.failUnless(problems)
+        self.assertEqual(updated, integrity.DEFERRED)
+
+    def test_command_checkpoint(self):
+        trees = list(integrity.tree_ids(models.Topic))
+        node = models.Topic.objects.get_by_full_name("x/y")
+        models.Topic.objects.filter(pk=node.pk).update(level=0)
+        checkpoint = tempfile.mktemp()
+        checkpoint_file = open(checkpoint, "w")
+        # Pretend an earlier run got as far as the tree holding "x/y".
+        checkpoint_file.write("".join(["%d\n" % tree_id for tree_id in trees
+                if tree_id != node.tree_id]))
+        checkpoint_file.close()
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            management.call_command("checktopics", repair=True,
+                    checkpoint=checkpoint)
+            output = sys.stdout.getvalue()
+            progress = sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+        self.failUnless("Resuming: %d trees already done" % (len(trees) - 1)
+                in progress)
+        self.failUnless("Processed 1 of 1 trees" in progress)
+        self.failUnless("1 trees checked, 1 with problems, 1 rebuilt" in
+                output)
+        self.failIf(os.path.exists(checkpoint))
+        self.assertEqual(self.problems(), [])
@@ -0,0 +1,83 @@
+"""
+Tests for full name lookups that ignore case and Unicode normalisation.
+"""
+from django import db, test
+
+from acacia import collation
+from sampletopics.models import FoldedTopic
+
+
+class NormalisedLookupTest(test.TestCase):
+    def setUp(self):
+        self.cat = FoldedTopic.objects.get_or_create_by_full_name(
+                u"animal/cat")[0]
+        self.cafe = FoldedTopic.objects.get_or_create_by_full_name(
+                u"places/caf\xe9")[0]
+
+    def test_lookup_key(self):
+        self.assertEqual(collation.lookup_key(u"CAT"), u"cat")
+        self.assertEqual(collation.lookup_key(u"Stra\xdfe"), u"strasse")
+        self.assertEqual(collation.lookup_key(u"cafe\u0301"), u"caf\xe9")
+        self.assertEqual(self.cat.name_key, u"cat")
+
+    def test_get_by_full_name(self):
+        for name in [u"Animal/CAT", u"ANIMAL/cat", u"animal//Cat"]:
+            self.assertEqual(FoldedTopic.objects.get_by_full_name(name).pk,
+                    self.cat.pk)
+        self.assertEqual(FoldedTopic.objects.get_by_full_name(
+                u"Places/CAFE\u0301").pk, self.cafe.pk)
+        self.assertRaises(FoldedTopic.DoesNotExist,
+                FoldedTopic.objects.get_by_full_name, u"animal/cats")
+
+    def test_get_or_create(self):
+        node, created = FoldedTopic.objects.get_or_create_by_full_name(
+                u"Animal/Cat")
+        self.failIf(created)
+        self.assertEqual(node.pk, self.cat.pk)
+        # The stored name keeps its original form.
+        self.assertEqual(unicode(node), u"animal/cat")
+
+        node, created = FoldedTopic.objects.get_or_create_by_full_name(
+                u"ANIMAL/Dog")
+        self.failUnless(created)
+        self.assertEqual(node.parent_id, self.cat.parent_id)
+        self.assertEqual(FoldedTopic.objects.count(), 5)
+
+    def test_unique_siblings(self):
+        parent = FoldedTopic.objects.get(pk=self.cat.parent_id)
+        self.assertRaises(db.IntegrityError, FoldedTopic.objects.create,
+                name=u"CAT", parent=parent)
+
+    def test_merge_variant(self):
+        # "Animals/Cat" merges into "animal/cat" despite the different case.
+        child = FoldedTopic.objects.get_or_create_by_full_name(
+                u"Animals/Cat/kitten")[0]
+        node = FoldedTopic.objects.get_by_full_name(u"animals/cat")
+        node.merge_to(FoldedTopic.objects.get(pk=self.cat.parent_id))
+        self.assertEqual(FoldedTopic.objects.get(pk=child.pk).parent_id,
+                self.cat.pk)
+        self.assertEqual(FoldedTopic.objects.filter(name_key=u"cat").count(), 1)
+
+    def test_refresh(self):
+        FoldedTopic.objects.filter(pk=self.cat.pk).update(name_key=u"")
+        self.assertEqual(collation.refresh_lookup_keys(FoldedTopic), 1)
+        self.assertEqual(FoldedTopic.objects.get_by_full_name(u"animal/CAT").pk,
+                self.cat.pk)
+
+    def test_sync(self):
+        """
+        Tests that sync() matches nodes by their lookup keys, so a desired
+        name differing only in case keeps the existing node.
+        """
+        plan = FoldedTopic.objects.sync([u"Animal/Cat", u"PLACES/CAF\xc9"])
+        self.failIf(plan)
+        self.assertEqual(FoldedTopic.objects.get(pk=self.cat.pk).name, u"cat")
+
+        plan = FoldedTopic.objects.sync([u"Pets/CAT", u"places/caf\xe9"])
+        self.assertEqual(plan.creates, [u"Pets"])
+        self.assertEqual([move[1:] for move in plan.moves],
+                [(u"animal/cat", u"Pets/CAT")])
+        self.assertEqual([delete[1] for delete in plan.deletes], [u"animal"])
+        node = FoldedTopic.objects.get_by_full_name(u"pets/cat")
+        self.assertEqual(node.pk, self.cat.pk)
+        self.assertEqual(unicode(node), u"Pets/cat")
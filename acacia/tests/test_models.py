@@ -2,9 +2,48 @@
 Tests for the hierarchical topic structure.
 """
 from django import db, test
+from django.conf import settings
+
+from mptt.exceptions import InvalidMove
 
 from acacia import models, signals
 
+def check_tree(testcase):
+    """
+    Checks that the nested set values of every topic agree with the parent
+    links.
+    """
+    nodes = list(models.Topic.objects.all())
+    by_id = dict([(node.id, node) for node in nodes])
+    for node in nodes:
+        expected = set()
+        depth = 0
+        parent_id = node.parent_id
+        while parent_id is not None:
+            expected.add(parent_id)
+            parent_id = by_id[parent_id].parent_id
+            depth += 1
+        ancestors = set([obj.id for obj in node.get_ancestors()])
+        testcase.assertEqual(ancestors, expected)
+        testcase.assertEqual(node.level, depth)
+        testcase.assertEqual(node.rght - node.lft - 1,
+                2 * (len(node.get_descendants())))
+
+def count_queries(func, *args):
+    """
+    Calls func(*args) and returns a pair: its result and the number of
+    database queries it made.
+    """
+    old_debug = settings.DEBUG
+    settings.DEBUG = True
+    db.reset_queries()
+    try:
+        result = func(*args)
+        return result, len(db.connection.queries)
+    finally:
+        settings.DEBUG = old_debug
+
+
 class BaseTestSetup(object):
     """
     Common test support stuff, used by multiple test suites.
@@ -237,6 +276,7 @@ class TopicTest(BaseTestSetup, test.TestCase):
         except models.Topic.DoesNotExist:
             self.fail("Didn't move x/y node correctly.")
         self.assertEqual(node.id, y_child.id)
+        check_tree(self)
 
     def test_move_is_not_merge(self):
         """
@@ -302,3 +342,55 @@ class TopicTest(BaseTestSetup, test.TestCase):
         self.assertRaises(db.IntegrityError, models.Topic.objects.create,
                 name="b", parent=parent)
 
+    def test_bulk_move(self):
+        """
+        Tests that several subtrees can be moved at once, including between
+        trees and to become new roots.
+        """
+        b_node = models.Topic.objects.get_by_full_name("c/b")
+        y_node = models.Topic.objects.get_by_full_name("x/y")
+        c_node = models.Topic.objects.get_by_full_name("a/x/c")
+        c_root = models.Topic.objects.get_by_full_name("c")
+        target = models.Topic.objects.get_by_full_name("a/b")
+        models.Topic.objects.bulk_move([(b_node, target), (y_node, None),
+                (c_node, c_root)])
+        result = sorted([unicode(obj) for obj in models.Topic.objects.all()])
+        expected = [u"a", u"a/b", u"a/b/b", u"a/b/b/d", u"a/b/c", u"a/x",
+                u"c", u"c/c", u"x", u"y", u"y/c"]
+        self.assertEqual(result, expected)
+        self.assertEqual(b_node.parent, target)
+        self.assertEqual(b_node.level, 2)
+        self.assertEqual(unicode(b_node), u"a/b/b")
+        self.assertEqual(y_node.level, 0)
+        check_tree(self)
+
+    def test_bulk_move_signal(self):
+        """
+        Tests that a bulk move sends one pre_move signal with all the moves.
+        """
+        b_node = models.Topic.objects.get_by_full_name("c/b")
+        y_node = models.Topic.objects.get_by_full_name("x/y")
+        target = models.Topic.objects.get_by_full_name("a/b")
+        signals.pre_move.connect(self.signal_catcher)
+        models.Topic.objects.bulk_move([(b_node, target), (y_node, target)])
+        signals.pre_move.disconnect(self.signal_catcher)
+        self.assertEqual(len(self.signals), 1)
+        self.assertEqual(self.signals[0][1]["moving"], [(b_node, target),
+                (y_node, target)])
+
+    def test_bulk_move_cycle(self):
+        """
+        Tests that moves that would create a cycle, even in combination, are
+        rejected before anything is changed.
+        """
+        a_node = models.Topic.objects.get_by_full_name("a")
+        b_node = models.Topic.objects.get_by_full_name("a/b")
+        x_node = models.Topic.objects.get_by_full_name("x")
+        y_node = models.Topic.objects.get_by_full_name("x/y")
+        self.assertRaises(InvalidMove, models.Topic.objects.bulk_move,
+                [(a_node, b_node)])
+        self.assertRaises(InvalidMove, models.Topic.objects.bulk_move,
+                [(a_node, y_node), (x_node, b_node)])
+        self.assertEqual(unicode(models.Topic.objects.get(id=a_node.id)), u"a")
+        self.assertEqual(unicode(models.Topic.objects.get(id=x_node.id)), u"x")
+        check_tree(self)
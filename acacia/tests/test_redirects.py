@@ -0,0 +1,132 @@
+"""
+Tests for the optional redirects application.
+"""
+from django import http, test
+from django.core.cache import cache
+
+from acacia import models
+from acacia.topicredirects import middleware, shortcuts
+from acacia.topicredirects.models import TopicRedirect
+from acacia.tests.test_models import BaseTestSetup
+
+
+class RedirectTest(BaseTestSetup, test.TestCase):
+    def setUp(self):
+        super(RedirectTest, self).setUp()
+        cache.clear()
+
+    def test_rename_records_subtree(self):
+        """
+        Tests that renaming a node records redirects for the node and all its
+        descendants.
+        """
+        node = models.Topic.objects.get_by_full_name("a/x")
+        child = models.Topic.objects.get_by_full_name("a/x/c")
+        node.name = "z"
+        node.save()
+        self.assertEqual(TopicRedirect.objects.resolve("a/x").id, node.id)
+        self.assertEqual(TopicRedirect.objects.resolve("a/x/c").id, child.id)
+        self.assertEqual(unicode(TopicRedirect.objects.resolve("a//x/c/")),
+                u"a/z/c")
+
+    def test_reparent_records_subtree(self):
+        """
+        Tests that changing a node's parent and saving it records redirects
+        from the old names.
+        """
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.parent = models.Topic.objects.get_by_full_name("c/b")
+        node.save()
+        self.assertEqual(unicode(TopicRedirect.objects.resolve("a/x/c")),
+                u"c/b/x/c")
+
+    def test_merge_records_redirects(self):
+        """
+        Tests that moved and merged nodes from a merge_to() call all get
+        redirects pointing at their new locations.
+        """
+        models.Topic.objects.get_or_create_by_full_name("x/y/z")
+        node = models.Topic.objects.get_by_full_name("x")
+        node.merge_to(models.Topic.objects.get_by_full_name("a"))
+        self.assertEqual(unicode(TopicRedirect.objects.resolve("x")), u"a/x")
+        self.assertEqual(unicode(TopicRedirect.objects.resolve("x/y/z")),
+                u"a/x/y/z")
+        self.assertEqual(unicode(TopicRedirect.objects.resolve("x/y/c")),
+                u"a/x/y/c")
+
+    def test_chains_are_collapsed(self):
+        """
+        Tests that after repeated renames and a merge, every old name
+        redirects straight to the surviving topic.
+        """
+        node = models.Topic.objects.get_by_full_name("x/y")
+        node.name = "w"
+        node.save()
+        # Warm the cache before the merge to check it gets invalidated.
+        self.assertEqual(TopicRedirect.objects.resolve("x/y").id, node.id)
+        node = models.Topic.objects.get_by_full_name("x/w")
+        node.name = "y"
+        node.save()
+        models.Topic.objects.get_by_full_name("x").merge_to(
+                models.Topic.objects.get_by_full_name("a"))
+        survivor = models.Topic.objects.get_by_full_name("a/x/y")
+        for name in ("x/y", "x/w"):
+            self.assertEqual(TopicRedirect.objects.resolve(name).id,
+                    survivor.id)
+        self.assertEqual(TopicRedirect.objects.filter(old_name="x/y").count(),
+                1)
+
+    def test_moving_back_removes_redirect(self):
+        """
+        Tests that moving a topic back to an old name removes the redirect for
+        that name.
+        """
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.name = "z"
+        node.save()
+        node.name = "x"
+        node.save()
+        self.assertRaises(TopicRedirect.DoesNotExist,
+                TopicRedirect.objects.resolve, "a/x")
+        self.assertEqual(TopicRedirect.objects.resolve("a/z").id, node.id)
+
+    def test_cached_lookup(self):
+        """
+        Tests that a repeated lookup only costs a primary key query and misses
+        are cached, too.
+        """
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.name = "z"
+        node.save()
+        TopicRedirect.objects.resolve("a/x")
+        self.assertRaises(TopicRedirect.DoesNotExist,
+                TopicRedirect.objects.resolve, "nowhere")
+        TopicRedirect.objects.all().delete()
+        self.assertEqual(TopicRedirect.objects.resolve("a/x").id, node.id)
+        self.assertRaises(TopicRedirect.DoesNotExist,
+                TopicRedirect.objects.resolve, "nowhere")
+
+    def test_get_topic_or_redirect(self):
+        node = models.Topic.objects.get_by_full_name("a/x")
+        self.assertEqual(shortcuts.get_topic_or_redirect("a/x"), (node, False))
+        node.name = "z"
+        node.save()
+        self.assertEqual(shortcuts.get_topic_or_redirect("a/x"), (node, True))
+        self.assertRaises(models.Topic.DoesNotExist,
+                shortcuts.get_topic_or_redirect, "a/q")
+
+    def test_middleware(self):
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.name = "z"
+        node.save()
+        request = http.HttpRequest()
+        request.path_info = u"/a/x/c/"
+        response = middleware.TopicRedirectFallbackMiddleware(
+                ).process_response(request, http.HttpResponseNotFound())
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"], "/a/z/c/")
+
+        request.path_info = u"/a/q/"
+        response = middleware.TopicRedirectFallbackMiddleware(
+                ).process_response(request, http.HttpResponseNotFound())
+        self.assertEqual(response.status_code, 404)
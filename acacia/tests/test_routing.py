@@ -0,0 +1,169 @@
+"""
+Tests for multiple database support and the read replica router.
+"""
+import time
+
+from django import db, http, test
+
+from acacia import models, routers
+from acacia.tests.test_models import BaseTestSetup
+
+
+class MultipleDatabaseTest(BaseTestSetup, test.TestCase):
+    """
+    Tests that all queries go to the database selected with db_manager().
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(MultipleDatabaseTest, self).setUp()
+        # Copy the tree to the "other" database and then make it differ from
+        # the original.
+        for obj in models.Topic.objects.all():
+            obj.save(using="other", force_insert=True)
+        models.Topic.objects.using("other").filter(name="x",
+                level=1).update(name="q")
+        self.other = models.Topic.objects.db_manager("other")
+
+    def test_get_by_full_name(self):
+        node = self.other.get_by_full_name("a/q/c")
+        self.assertEqual(node._state.db, "other")
+        self.assertRaises(models.Topic.DoesNotExist,
+                self.other.get_by_full_name, "a/x/c")
+        self.assertRaises(models.Topic.DoesNotExist,
+                models.Topic.objects.get_by_full_name, "a/q/c")
+
+    def test_full_name(self):
+        node = models.Topic.objects.using("other").get(name="c",
+                parent__name="q")
+        self.assertEqual(node.full_name(), u"a/q/c")
+
+    def test_get_subtree(self):
+        result = [obj.name for obj in self.other.get_subtree("a")]
+        self.assertEqual(result, [u"a", u"b", u"c", u"q", u"c"])
+
+    def test_get_or_create_existing(self):
+        node, created = self.other.get_or_create_by_full_name("a/q")
+        self.assertEqual(created, False)
+        self.assertEqual(node._state.db, "other")
+
+
+class ReplicaRouterTest(test.TestCase):
+    def setUp(self):
+        routers.unpin()
+        self.router = routers.TopicReplicaRouter()
+        self.router.primary = "default"
+        self.router.replicas = ["other"]
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(models.Topic), "other")
+
+    def test_writes_use_primary(self):
+        self.assertEqual(self.router.db_for_write(models.Topic), "default")
+
+    def test_read_after_write(self):
+        """
+        Tests that reads go to the primary for a while after a write, but not
+        after merely routing a query for writing.
+        """
+        self.router.db_for_write(models.Topic)
+        self.failIf(routers.is_pinned())
+        models.Topic.objects.create(name="q")
+        self.assertEqual(self.router.db_for_read(models.Topic), "default")
+        routers.pin_to_primary(-1)
+        self.assertEqual(self.router.db_for_read(models.Topic), "default")
+        routers.unpin()
+        self.assertEqual(self.router.db_for_read(models.Topic), "other")
+
+    def test_instance_hint(self):
+        node = models.Topic(name="a")
+        node._state.db = "default"
+        self.assertEqual(self.router.db_for_read(models.Topic, instance=node),
+                "default")
+        node._state.db = "other"
+        self.assertEqual(self.router.db_for_read(models.Topic, instance=node),
+                "other")
+        # Pinning overrides the instance's database.
+        routers.pin_to_primary()
+        self.assertEqual(self.router.db_for_read(models.Topic, instance=node),
+                "default")
+
+    def test_lookup_does_not_pin(self):
+        models.Topic.objects.create(name="a")
+        routers.unpin()
+        models.Topic.objects.get_or_create_by_full_name("a")
+        self.failIf(routers.is_pinned())
+        models.Topic.objects.get_or_create_by_full_name("a/b")
+        self.assert_(routers.is_pinned())
+
+    def test_other_models_ignored(self):
+        from django.contrib.contenttypes.models import ContentType
+        self.assertEqual(self.router.db_for_read(ContentType), None)
+        self.assertEqual(self.router.db_for_write(ContentType), None)
+        self.failIf(routers.is_pinned())
+
+    def test_syncdb(self):
+        self.assertEqual(self.router.allow_syncdb("default", models.Topic),
+                True)
+        self.assertEqual(self.router.allow_syncdb("other", models.Topic),
+                False)
+
+    def test_sticky_middleware(self):
+        middleware = routers.StickyPrimaryMiddleware()
+        request = http.HttpRequest()
+        middleware.process_request(request)
+        models.Topic.objects.create(name="a")
+        response = middleware.process_response(request, http.HttpResponse())
+        cookie = response.cookies[middleware.cookie_name].value
+
+        # A later request from the same client is pinned, even if the thread
+        # has been used for something else in between.
+        routers.unpin()
+        request = http.HttpRequest()
+        request.COOKIES[middleware.cookie_name] = cookie
+        middleware.process_request(request)
+        self.assert_(routers.is_pinned())
+
+        request.COOKIES[middleware.cookie_name] = str(time.time() - 1)
+        middleware.process_request(request)
+        self.failIf(routers.is_pinned())
+
+
+class ReplicaMergeTest(BaseTestSetup, test.TestCase):
+    """
+    Tests merges while the replica router is sending reads to a replica that
+    hasn't seen the merge's changes yet.
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaMergeTest, self).setUp()
+        for obj in models.Topic.objects.all():
+            obj.save(using="other", force_insert=True)
+        router = routers.TopicReplicaRouter()
+        router.primary = "default"
+        router.replicas = ["other"]
+        self.old_routers = db.router.routers
+        db.router.routers = [router]
+        routers.unpin()
+
+    def tearDown(self):
+        db.router.routers = self.old_routers
+        routers.unpin()
+        super(ReplicaMergeTest, self).tearDown()
+
+    def test_merge_from_replica_instance(self):
+        node = models.Topic.objects.using("other").get(name="x", level=0)
+        self.assertEqual(node._state.db, "other")
+        node.merge_to(models.Topic.objects.using("default").get(name="a",
+                level=0))
+        primary = models.Topic.objects.db_manager("default")
+        self.assertEqual(unicode(primary.get_by_full_name("a/x/y/c")),
+                u"a/x/y/c")
+        self.assertRaises(models.Topic.DoesNotExist, primary.get_by_full_name,
+                "x")
+        # Only the root "x" was removed, by being merged into "a/x".
+        self.assertEqual(primary.count(), 10)
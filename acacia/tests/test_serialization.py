@@ -0,0 +1,53 @@
+"""
+Tests for nested serialisation of subtrees.
+"""
+from django import test
+from django.utils import simplejson
+
+from acacia import models
+from acacia.tests.test_models import BaseTestSetup, count_queries
+
+
+def names(tree):
+    """
+    Reduces a nested topic structure to (name, [children]) pairs.
+    """
+    return (tree["name"], [names(child) for child in tree["children"]])
+
+
+class SerializationTest(BaseTestSetup, test.TestCase):
+    def test_nested(self):
+        node = models.Topic.objects.get_by_full_name("a")
+        tree = node.as_nested()
+        self.assertEqual(tree["id"], node.id)
+        self.assertEqual(names(tree), (u"a", [(u"b", [(u"c", [])]),
+                (u"x", [(u"c", [])])]))
+
+    def test_single_query(self):
+        node = models.Topic.objects.get_by_full_name("c")
+        tree, queries = count_queries(node.as_nested)
+        self.assertEqual(queries, 1)
+        self.assertEqual(names(tree), (u"c", [(u"b", [(u"d", [])])]))
+
+    def test_depth_and_fields(self):
+        tree = models.Topic.objects.get_nested_subtree("a", fields=["name",
+                "level"], depth=1)
+        self.assertEqual(tree, {"name": u"a", "level": 0, "children": [
+                {"name": u"b", "level": 1, "children": []},
+                {"name": u"x", "level": 1, "children": []}]})
+        tree = models.Topic.objects.get_nested_subtree("a/b", depth=0)
+        self.assertEqual(names(tree), (u"b", []))
+        self.assertRaises(models.Topic.DoesNotExist,
+                models.Topic.objects.get_nested_subtree, "a/q")
+
+    def test_json(self):
+        for full_name in ["a", "a/b", "a/b/c", "c"]:
+            for depth in [None, 0, 1]:
+                node = models.Topic.objects.get_by_full_name(full_name)
+                output = "".join(node.iter_json(depth=depth))
+                self.assertEqual(simplejson.loads(output),
+                        node.as_nested(depth=depth))
+        output = "".join(models.Topic.objects.iter_subtree_json("x",
+                fields=["name"]))
+        self.assertEqual(simplejson.loads(output), {"name": u"x", "children":
+                [{"name": u"y", "children": [{"name": u"c", "children": []}]}]})
@@ -0,0 +1,121 @@
+"""
+Tests for memory-mapped tree snapshots.
+"""
+import os
+import shutil
+import tempfile
+
+from django import test
+from django.conf import settings
+
+from acacia import models, signals, snapshot
+from acacia.tests.test_models import BaseTestSetup, count_queries
+from sampletopics.models import FoldedTopic
+
+
+class SnapshotTest(BaseTestSetup, test.TestCase):
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.old_setting = getattr(settings, "ACACIA_SNAPSHOTS", False)
+        settings.ACACIA_SNAPSHOTS = True
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "topics.snapshot")
+        snapshot.dump(models.Topic, self.path)
+        self.snapshot = snapshot.TreeSnapshot(models.Topic, self.path)
+
+    def tearDown(self):
+        self.snapshot.close()
+        shutil.rmtree(self.directory)
+        settings.ACACIA_SNAPSHOTS = self.old_setting
+
+    def test_resolve(self):
+        self.failUnless(self.snapshot.is_current())
+        self.assertEqual(self.snapshot.count, models.Topic.objects.count())
+        names = [(unicode(node), node.pk) for node in
+                models.Topic.objects.all()]
+        expected = models.Topic.objects.get_by_full_name(u"a/x/c").pk
+
+        def resolve_all():
+            for name, pk in names:
+                self.assertEqual(self.snapshot.resolve(name), pk)
+            self.assertEqual(self.snapshot.resolve(u"/a//x/c/"), expected)
+            self.assertRaises(models.Topic.DoesNotExist,
+                    self.snapshot.resolve, u"a/b/d")
+            self.assertRaises(models.Topic.DoesNotExist,
+                    self.snapshot.resolve, u"")
+        # The snapshot doesn't use the database at all.
+        self.assertEqual(count_queries(resolve_all)[1], 0)
+
+    def test_ancestors(self):
+        node = models.Topic.objects.get_by_full_name(u"c/b/d")
+        self.assertEqual([name for _, name in self.snapshot.ancestors(node.pk)],
+                [u"c", u"b"])
+        self.assertEqual(self.snapshot.full_name(node.pk), u"c/b/d")
+        root = models.Topic.objects.get_by_full_name(u"c")
+        self.assertEqual(self.snapshot.ancestors(root.pk), [])
+        self.assertRaises(models.Topic.DoesNotExist, self.snapshot.ancestors,
+                12345)
+
+    def test_stale(self):
+        node = models.Topic.objects.get_by_full_name(u"a/b")
+        node.name = u"renamed"
+        node.save()
+        self.failIf(self.snapshot.is_current())
+        # Answers now come from the database.
+        self.assertEqual(self.snapshot.full_name(node.pk), u"a/renamed")
+        self.assertEqual(self.snapshot.resolve(u"a/renamed/c"),
+                models.Topic.objects.get_by_full_name(u"a/renamed/c").pk)
+
+        # A new snapshot is picked up automatically.
+        snapshot.dump(models.Topic, self.path)
+        self.failUnless(self.snapshot.is_current())
+        self.assertEqual(self.snapshot.full_name(node.pk), u"a/renamed")
+
+    def test_bulk_changes_make_stale(self):
+        node = models.Topic.objects.get_by_full_name(u"a/x")
+        target = models.Topic.objects.get_by_full_name(u"c")
+        models.Topic.objects.bulk_move([(node, target)])
+        self.failIf(self.snapshot.is_current())
+
+    def test_moves_make_stale(self):
+        node = models.Topic.objects.get_by_full_name(u"c/b")
+        node.move_to(models.Topic.objects.get_by_full_name(u"x"))
+        self.failIf(self.snapshot.is_current())
+        self.assertRaises(models.Topic.DoesNotExist, self.snapshot.resolve,
+                u"c/b")
+        self.assertEqual(self.snapshot.resolve(u"x/b/d"),
+                models.Topic.objects.get_by_full_name(u"x/b/d").pk)
+
+        # A snapshot dumped as merge_to() signals the move is stale by the
+        # time the move is done.
+        snapshot.dump(models.Topic, self.path)
+        self.failUnless(self.snapshot.is_current())
+
+        def dump(**kwargs):
+            snapshot.dump(models.Topic, self.path)
+        signals.pre_move.connect(dump)
+        try:
+            node = models.Topic.objects.get_by_full_name(u"x/b")
+            node.merge_to(models.Topic.objects.get_by_full_name(u"a/x"))
+        finally:
+            signals.pre_move.disconnect(dump)
+        self.failIf(self.snapshot.is_current())
+        self.assertEqual(self.snapshot.full_name(node.pk), u"a/x/b")
+
+    def test_disabled(self):
+        settings.ACACIA_SNAPSHOTS = False
+        self.failIf(self.snapshot.is_current())
+        self.assertEqual(self.snapshot.full_name(
+                models.Topic.objects.get_by_full_name(u"x/y").pk), u"x/y")
+
+    def test_lookup_key(self):
+        node = FoldedTopic.objects.get_or_create_by_full_name(
+                u"Animal/Cat")[0]
+        path = os.path.join(self.directory, "folded.snapshot")
+        snapshot.dump(FoldedTopic, path)
+        folded = snapshot.TreeSnapshot(FoldedTopic, path)
+        try:
+            self.assertEqual(folded.resolve(u"ANIMAL/cat"), node.pk)
+            self.assertEqual(folded.full_name(node.pk), u"Animal/Cat")
+        finally:
+            folded.close()
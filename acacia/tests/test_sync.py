@@ -0,0 +1,151 @@
+"""
+Tests for synchronising a topic tree with a list of full names.
+"""
+import os
+import sys
+import tempfile
+from StringIO import StringIO
+
+from django import test
+from django.core import management
+
+from acacia import models, signals
+from acacia.tests.test_models import BaseTestSetup, check_tree
+
+CURRENT = [u"a", u"a/b", u"a/b/c", u"a/x", u"a/x/c", u"c", u"c/b", u"c/b/d",
+        u"x", u"x/y", u"x/y/c"]
+
+
+class SyncTest(BaseTestSetup, test.TestCase):
+    def full_names(self):
+        return sorted([unicode(obj) for obj in models.Topic.objects.all()])
+
+    def test_no_changes(self):
+        plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "c/b/d",
+                "x/y/c"])
+        self.failIf(plan)
+        self.assertEqual(self.full_names(), CURRENT)
+
+    def test_create(self):
+        plan = models.Topic.objects.sync(CURRENT + ["a/b/e", "n/m"])
+        self.assertEqual(plan.creates, [u"n", u"n/m", u"a/b/e"])
+        self.assertEqual((plan.moves, plan.merges, plan.deletes), ([], [], []))
+        self.assertEqual(self.full_names(), sorted(CURRENT + [u"a/b/e", u"n",
+                u"n/m"]))
+        check_tree(self)
+
+    def test_delete(self):
+        plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "x/y/c"])
+        self.assertEqual([(name, count) for _, name, count in plan.deletes],
+                [(u"c", 2)])
+        self.assertEqual(self.full_names(), [name for name in CURRENT
+                if not name.startswith("c")])
+        check_tree(self)
+
+    def test_move(self):
+        """
+        Tests that a node that disappears from one place and turns up
+        somewhere else is moved, not recreated.
+        """
+        b_node = models.Topic.objects.get_by_full_name("c/b")
+        d_node = models.Topic.objects.get_by_full_name("c/b/d")
+        signals.pre_move.connect(self.signal_catcher)
+        try:
+            plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "x/y/c",
+                    "q/b/d"])
+        finally:
+            signals.pre_move.disconnect(self.signal_catcher)
+        self.assertEqual(plan.creates, [u"q"])
+        self.assertEqual([move[1:] for move in plan.moves],
+                [(u"c/b", u"q/b")])
+        self.assertEqual([delete[1] for delete in plan.deletes], [u"c"])
+        self.assertEqual(models.Topic.objects.get_by_full_name("q/b").id,
+                b_node.id)
+        self.assertEqual(models.Topic.objects.get_by_full_name("q/b/d").id,
+                d_node.id)
+        self.assertEqual(len(self.signals), 1)
+        moving = self.signals[0][1]["moving"]
+        self.assertEqual([(node.id, unicode(parent))
+                for node, parent in moving], [(b_node.id, u"q")])
+        check_tree(self)
+
+    def test_merge(self):
+        """
+        Tests that moving the children of a removed node to an existing node
+        with the same name is reported as a merge.
+        """
+        x_node = models.Topic.objects.get_by_full_name("x")
+        y_node = models.Topic.objects.get_by_full_name("x/y")
+        survivor = models.Topic.objects.get_by_full_name("a/x")
+        signals.pre_merge.connect(self.signal_catcher)
+        try:
+            plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "a/x/y/c",
+                    "c/b/d"])
+        finally:
+            signals.pre_merge.disconnect(self.signal_catcher)
+        self.assertEqual(plan.creates, [])
+        self.assertEqual([move[1:] for move in plan.moves],
+                [(u"x/y", u"a/x/y")])
+        self.assertEqual(plan.merges, [(x_node.id, u"x", survivor.id,
+                u"a/x")])
+        self.assertEqual(plan.deletes, [])
+        self.assertEqual(self.signals[0][1]["merge_pairs"],
+                [(x_node.id, survivor.id)])
+        self.assertEqual(models.Topic.objects.get_by_full_name("a/x/y").id,
+                y_node.id)
+        self.assertEqual(self.full_names(), [u"a", u"a/b", u"a/b/c", u"a/x",
+                u"a/x/c", u"a/x/y", u"a/x/y/c", u"c", u"c/b", u"c/b/d"])
+        check_tree(self)
+
+    def test_move_to_root(self):
+        plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "c/b/d", "y/c"])
+        self.assertEqual([move[1:] for move in plan.moves], [(u"x/y", u"y")])
+        self.assertEqual(self.full_names(), [u"a", u"a/b", u"a/b/c", u"a/x",
+                u"a/x/c", u"c", u"c/b", u"c/b/d", u"y", u"y/c"])
+        check_tree(self)
+
+    def test_plan_only(self):
+        plan = models.Topic.objects.sync(["z"], commit=False)
+        self.assertEqual(plan.creates, [u"z"])
+        self.assertEqual(self.full_names(), CURRENT)
+        plan.apply()
+        self.assertEqual(self.full_names(), [u"z"])
+
+    def test_describe(self):
+        plan = models.Topic.objects.sync(["a/b/c", "a/x/c", "x/y/c",
+                "q/b/d", "a/b/e"], commit=False)
+        self.assertEqual(plan.describe(), [u"create  q", u"create  a/b/e",
+                u"move    c/b -> q/b", u"delete  c"])
+
+    def test_describe_moves(self):
+        """
+        Tests that every change is described against the current tree, even
+        when an earlier move takes a later one's node along with it.
+        """
+        plan = models.Topic.objects.sync(["b/c", "x/c", "y/c", "b/d"],
+                commit=False)
+        self.assertEqual(plan.describe(), [u"create  y",
+                u"move    c -> y/c", u"move    a/b -> b",
+                u"move    a/x/c -> x/c", u"move    c/b/d -> b/d",
+                u"merge   a/x -> x", u"delete  a (and 1 descendants)",
+                u"delete  c/b", u"delete  x/y (and 1 descendants)"])
+        plan.apply()
+        self.assertEqual(self.full_names(), [u"b", u"b/c", u"b/d", u"x",
+                u"x/c", u"y", u"y/c"])
+        check_tree(self)
+
+    def test_management_command(self):
+        handle, filename = tempfile.mkstemp()
+        os.write(handle, "# Comment\na/b/c\n\na/x/c\nc/b/d\nx/y/c\nn\n")
+        os.close(handle)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            management.call_command("synctopics", filename, dry_run=True)
+            self.assertEqual(sys.stdout.getvalue(), "create  n\n")
+            self.assertEqual(self.full_names(), CURRENT)
+            management.call_command("synctopics", filename, interactive=False)
+        finally:
+            sys.stdout = stdout
+            os.remove(filename)
+        self.assertEqual(self.full_names(), sorted(CURRENT + [u"n"]))
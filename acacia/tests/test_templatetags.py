@@ -6,6 +6,7 @@ Tests for the custom template acacia template tags.
 from django import template, test
 
 from acacia import models
+from acacia.tests.test_models import count_queries
 
 
 def setup_from_node_strings(nodes):
@@ -218,3 +219,102 @@ class TreeTrunkFullContentTests(test.TestCase):
         self.assertEqual(output, expected, "\nGot      %s\n\nExpected %s" %
                 (output, expected))
 
+
+
+class TopicTreeTests(test.TestCase):
+    def setUp(self):
+        setup_from_node_strings(["root1/child1/grandchild1", "root1/child2",
+                "root2/<b>"])
+
+    def test_lazy_model(self):
+        compiled = template.Template(
+                "{% load acacia %}{% treetrunk bad.Topic %}")
+        self.assertRaises(template.TemplateSyntaxError, compiled.render,
+                template.Context({}))
+        compiled = template.Template(
+                "{% load acacia %}{% treetrunk acacia.Topic %}")
+        node = compiled.nodelist[-1]
+        self.assertEqual(node._model, None)
+        compiled.render(template.Context({}))
+        self.failUnless(node._model is models.Topic)
+
+    def test_custom_markup(self):
+        output = convert("{% load acacia %}{% topictree acacia.Topic 3 %}"
+                "[{{ node.name }}{% if children %}:{{ children }}{% endif %}]"
+                "{% endtopictree %}")
+        self.assertEqual(output, "[root1:[child1:[grandchild1]][child2]]"
+                "[root2:[&lt;b&gt;]]")
+
+    def test_levels(self):
+        output = convert("{% load acacia %}{% topictree acacia.Topic %}"
+                "<{{ node.level }}{{ children }}>{% endtopictree %}")
+        self.assertEqual(output, "<0<1><1>><0<1>>")
+        output = convert("{% load acacia %}{% topictree acacia.Topic 1 %}"
+                "({{ node.name }}){% endtopictree %}")
+        self.assertEqual(output, "(root1)(root2)")
+
+    def test_context_restored(self):
+        output = convert("{% load acacia %}{% topictree acacia.Topic 1 %}"
+                "{% endtopictree %}[{{ node }}]")
+        self.assertEqual(output, "[]")
+
+    def test_empty_tree(self):
+        models.Topic.objects.all().delete()
+        self.assertEqual(convert("{% load acacia %}{% topictree acacia.Topic %}"
+                "x{% endtopictree %}"), "")
+
+    def test_errors(self):
+        self.assertRaises(template.TemplateSyntaxError, convert,
+                "{% load acacia %}{% topictree acacia.Topic 0 %}"
+                "{% endtopictree %}")
+        self.assertRaises(template.TemplateSyntaxError, convert,
+                "{% load acacia %}{% topictree acacia.Topic %}")
+        self.assertRaises(template.TemplateSyntaxError, convert,
+                "{% load acacia %}{% topictree acacia.Missing %}"
+                "{% endtopictree %}")
+
+
+class BreadcrumbTests(test.TestCase):
+    def setUp(self):
+        setup_from_node_strings(["animal/cat/big cat", "animal/dog",
+                "plant/tree"])
+
+    def test_breadcrumbs(self):
+        topic = models.Topic.objects.get_by_full_name("animal/cat/big cat")
+        output = template.Template("{% load acacia %}{% breadcrumbs topic %}"
+                ).render(template.Context({"topic": topic}))
+        self.assertEqual(output, u'<a href="/animal/">animal</a> / '
+                u'<a href="/animal/cat/">cat</a> / big cat')
+        output = template.Template("{% load acacia %}"
+                "{% breadcrumbs topic '/t/' %}").render(template.Context(
+                {"topic": topic.parent}))
+        self.assertEqual(output, u'<a href="/t/animal/">animal</a> / cat')
+
+    def test_prefetch(self):
+        topics = list(models.Topic.objects.all())
+        topics.append(None)
+        result, queries = count_queries(
+                models.Topic.objects.prefetch_ancestors, topics)
+        self.assertEqual(result, topics)
+        self.assertEqual(queries, 1)
+
+        compiled = template.Template("{% load acacia %}"
+                "{% for topic in topics %}{% breadcrumbs topic %}|"
+                "{% for node in topic|ancestor_path %}{{ node.full_name }},"
+                "{% endfor %}\n{% endfor %}")
+        output, queries = count_queries(compiled.render,
+                template.Context({"topics": topics}))
+        self.assertEqual(queries, 0)
+        self.failUnless(u'<a href="/animal/">animal</a> / '
+                u'<a href="/animal/cat/">cat</a> / big cat|animal,animal/cat,'
+                u'animal/cat/big cat,\n' in output)
+        for topic in topics[:-1]:
+            self.assertEqual(topic.full_name(),
+                    unicode(models.Topic.objects.get(pk=topic.pk)))
+
+    def test_ancestor_path(self):
+        topic = models.Topic.objects.get_by_full_name("plant/tree")
+        path, queries = count_queries(topic.ancestor_path)
+        self.assertEqual([node.name for node in path], [u"plant", u"tree"])
+        self.assertEqual(queries, 1)
+        self.assertEqual(count_queries(topic.ancestor_path)[1], 0)
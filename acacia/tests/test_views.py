@@ -0,0 +1,131 @@
+"""
+Tests for resolving topics in URLs and building URLs for topics.
+"""
+from django import http, test
+from django.conf import settings
+from django.conf.urls.defaults import patterns
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+
+from acacia import instrumentation, models, signals, views
+from acacia.tests.test_models import BaseTestSetup, count_queries
+
+
+def show_topic(request, topic):
+    return http.HttpResponse(topic.full_name())
+
+def not_found(request):
+    return http.HttpResponseNotFound()
+
+urlpatterns = patterns("",
+    views.topic_pattern(r"topics/", views.topic_view()(show_topic),
+            name="topic"),
+    views.topic_pattern(r"exact/", views.topic_view(redirect=False)(
+            show_topic), name="exact-topic"),
+)
+
+handler404 = "acacia.tests.test_views.not_found"
+
+
+class ViewTest(BaseTestSetup, test.TestCase):
+    def setUp(self):
+        super(ViewTest, self).setUp()
+        cache.clear()
+
+    def test_resolve(self):
+        node = models.Topic.objects.get_by_full_name("a/x/c")
+        self.assertEqual(views.resolve("a/x/c"), node)
+        topic, queries = count_queries(views.resolve, "a//x/c/")
+        self.assertEqual(topic, node)
+        self.assertEqual(queries, 1)
+        self.assertEqual(count_queries(topic.full_name), (u"a/x/c", 0))
+        self.assertEqual([obj.name for obj in topic.ancestor_path()],
+                [u"a", u"x", u"c"])
+        self.assertRaises(models.Topic.DoesNotExist, views.resolve, "a/q")
+        self.assertRaises(models.Topic.DoesNotExist, views.resolve, "/")
+
+    def test_stale_entries(self):
+        """
+        Tests that cached paths are checked against the database, so renames
+        and moves are noticed.
+        """
+        views.resolve("a/x/c")
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.name = "z"
+        node.save()
+        self.assertRaises(models.Topic.DoesNotExist, views.resolve, "a/x/c")
+        self.assertEqual(views.resolve("a/z/c").full_name(), u"a/z/c")
+        node = models.Topic.objects.get_by_full_name("a/z")
+        node.name = "x"
+        node.save()
+        self.assertEqual(views.resolve("a/x/c").full_name(), u"a/x/c")
+
+    def test_view(self):
+        response = self.client.get("/topics/a/x/c/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "a/x/c")
+        self.assertEqual(self.client.get("/topics/a/q/").status_code, 404)
+
+    def test_redirects(self):
+        response = self.client.get("/topics/a//x/c/", {"page": "2"})
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"],
+                "http://testserver/topics/a/x/c/?page=2")
+        node = models.Topic.objects.get_by_full_name("a/x")
+        node.name = "new name"
+        node.save()
+        response = self.client.get("/topics/a/x/c/")
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"],
+                "http://testserver/topics/a/new%20name/c/")
+        self.assertEqual(self.client.get("/exact/a/x/c/").status_code, 404)
+        self.assertEqual(self.client.get("/exact/a//new name/c/").status_code,
+                200)
+
+    def test_topic_urls(self):
+        models.Topic.objects.get_or_create_by_full_name("a/big cat")
+        topics = list(models.Topic.objects.filter(name__in=["c", "big cat"]))
+        urls, queries = count_queries(views.topic_urls, "topic", topics)
+        self.assertEqual(queries, 1)
+        self.assertEqual(sorted(urls), ["/topics/a/b/c/",
+                "/topics/a/big%20cat/", "/topics/a/x/c/", "/topics/c/",
+                "/topics/x/y/c/"])
+        self.assertEqual(urls, [reverse("topic", kwargs={"full_name":
+                topic.full_name()}) for topic in topics])
+        self.assertEqual(views.topic_urls("exact-topic", []), [])
+
+    def test_instrumented(self):
+        """
+        Tests that the view helpers work, and are reported, with
+        instrumentation enabled.
+        """
+        operations = []
+
+        def catcher(sender, operation, **kwargs):
+            operations.append((sender, operation))
+        signals.operation_timed.connect(catcher)
+        instrumentation.enable()
+        try:
+            self.assertEqual(self.client.get("/topics/a/x/c/").status_code,
+                    200)
+            self.assertEqual(len(views.topic_urls("topic",
+                    models.Topic.objects.filter(name="c"))), 4)
+        finally:
+            instrumentation.disable()
+            signals.operation_timed.disconnect(catcher)
+        self.failUnless((models.Topic, "resolve_url") in operations)
+        self.failUnless((models.Topic, "topic_urls") in operations)
+
+    def test_cached_miss_after_move(self):
+        """
+        Tests that a cached miss is forgotten once a move creates the name.
+        """
+        old_setting = getattr(settings, "ACACIA_SNAPSHOTS", False)
+        settings.ACACIA_SNAPSHOTS = True
+        try:
+            self.assertRaises(models.Topic.DoesNotExist, views.resolve, "x/b")
+            node = models.Topic.objects.get_by_full_name("c/b")
+            node.move_to(models.Topic.objects.get_by_full_name("x"))
+            self.assertEqual(views.resolve("x/b"), node)
+        finally:
+            settings.ACACIA_SNAPSHOTS = old_setting
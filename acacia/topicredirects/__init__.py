@@ -0,0 +1,7 @@
+"""
+An optional application that remembers the old full names of topics that have
+been renamed, moved or merged, so that URLs built from those names can be
+redirected to the topic's current location.
+
+Add "acacia.topicredirects" to INSTALLED_APPS (after "acacia") to enable it.
+"""
@@ -0,0 +1,31 @@
+from django import http
+from django.conf import settings
+from django.utils.encoding import iri_to_uri
+
+from acacia.topicredirects.models import TopicRedirect
+
+
+class TopicRedirectFallbackMiddleware(object):
+    """
+    Turns 404 responses for URLs containing an old topic name into permanent
+    redirects to the topic's current name.
+
+    The topic's full name is taken to be the part of the path following the
+    ACACIA_REDIRECT_URL_PREFIX setting (default "/"). Requests for paths that
+    don't start with that prefix are left alone.
+    """
+    def process_response(self, request, response):
+        if response.status_code != 404:
+            return response
+        prefix = getattr(settings, "ACACIA_REDIRECT_URL_PREFIX", "/")
+        path = request.path_info
+        if not path.startswith(prefix):
+            return response
+        try:
+            topic = TopicRedirect.objects.resolve(path[len(prefix):])
+        except TopicRedirect.DoesNotExist:
+            return response
+        new_path = prefix + topic.full_name()
+        if path.endswith("/"):
+            new_path += "/"
+        return http.HttpResponsePermanentRedirect(iri_to_uri(new_path))
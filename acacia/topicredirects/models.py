@@ -0,0 +1,221 @@
+"""
+Redirects from the old full names of topics to the topics themselves.
+
+Each redirect points directly at a topic (by primary key), rather than at
+another name. Moving or renaming a topic doesn't change its primary key, so a
+redirect never has to be followed more than once. Merges do remove topics, so
+any redirects pointing at a merged topic are repointed at the surviving topic
+as part of the merge.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.db.models import signals as model_signals
+from django.utils.hashcompat import md5_constructor
+
+from acacia import nestedset, signals
+from acacia.models import Topic
+
+# Full names longer than this can't be stored, so no redirects are recorded
+# for them.
+MAX_NAME_LENGTH = 255
+
+CACHE_TIMEOUT = getattr(settings, "ACACIA_REDIRECT_CACHE_TIMEOUT", 3600)
+
+# Cached in place of a topic id for names that are known not to redirect.
+NO_REDIRECT = 0
+
+
+def normalise(full_name):
+    """
+    Collapses repeated separators and removes leading and trailing ones, the
+    same way TopicManager.get_by_full_name() does.
+    """
+    sep = Topic.separator
+    return sep.join([piece for piece in full_name.split(sep) if piece])
+
+def cache_key(full_name):
+    """
+    Returns the cache key used for redirect lookups of the (normalised)
+    'full_name'. The name is hashed, since it may contain characters that
+    aren't valid in cache keys.
+    """
+    return "acacia.redirect.%s" % md5_constructor(
+            full_name.encode("utf-8")).hexdigest()
+
+
+class TopicRedirectManager(models.Manager):
+    def resolve(self, full_name):
+        """
+        Returns the topic that used to be known as 'full_name'.
+
+        Both hits and misses are cached, so repeated lookups of the same name
+        cost at most a single primary key lookup.
+
+        Raises TopicRedirect.DoesNotExist if there is no redirect for
+        'full_name'.
+        """
+        name = normalise(full_name)
+        key = cache_key(name)
+        topic_id = cache.get(key)
+        if topic_id is None:
+            try:
+                redirect = self.select_related("topic").get(old_name=name)
+            except self.model.DoesNotExist:
+                cache.set(key, NO_REDIRECT, CACHE_TIMEOUT)
+                raise
+            cache.set(key, redirect.topic_id, CACHE_TIMEOUT)
+            return redirect.topic
+        if topic_id == NO_REDIRECT:
+            raise self.model.DoesNotExist
+        try:
+            return Topic.objects.get(pk=topic_id)
+        except Topic.DoesNotExist:
+            cache.delete(key)
+            raise self.model.DoesNotExist
+
+    def record(self, redirects, live_names=()):
+        """
+        Stores a redirect for each (old_name, topic_id) pair in 'redirects',
+        replacing any existing redirect for the same name. Redirects for any
+        names in 'live_names' are removed, since those names now belong to
+        existing topics.
+        """
+        redirects = [(name, topic_id) for name, topic_id in redirects
+                if len(name) <= MAX_NAME_LENGTH]
+        stale = list(live_names) + [name for name, _ in redirects]
+        for start in range(0, len(stale), nestedset.BATCH_SIZE):
+            batch = stale[start:start + nestedset.BATCH_SIZE]
+            self.filter(old_name__in=batch).delete()
+        for name, topic_id in redirects:
+            self.create(old_name=name, topic_id=topic_id)
+        cache.delete_many([cache_key(name) for name in stale])
+
+    def repoint(self, old_id, new_id):
+        """
+        Changes all redirects to the topic with id 'old_id' to point at the
+        topic with id 'new_id' instead.
+        """
+        queryset = self.filter(topic=old_id)
+        names = list(queryset.values_list("old_name", flat=True))
+        if names:
+            queryset.update(topic=new_id)
+            cache.delete_many([cache_key(name) for name in names])
+
+
+class TopicRedirect(models.Model):
+    """
+    A full name that used to belong to 'topic'.
+    """
+    old_name = models.CharField(max_length=MAX_NAME_LENGTH, unique=True)
+    topic = models.ForeignKey(Topic, related_name="redirects")
+
+    objects = TopicRedirectManager()
+
+    def __unicode__(self):
+        return u"%s -> %s" % (self.old_name, self.topic_id)
+
+
+def _join(prefix, relative_name):
+    if relative_name:
+        return u"%s%s%s" % (prefix, Topic.separator, relative_name)
+    return prefix
+
+def _subtree_names(root):
+    """
+    Returns a list of (id, relative_name) pairs for 'root' and all of its
+    descendants, in tree order. Names are relative to 'root', so the root's
+    own relative name is empty.
+    """
+    path = []
+    result = []
+    base_level = root.level
+    for pk, name, level in root.get_descendants(True).values_list("id",
+            "name", "level"):
+        del path[level - base_level:]
+        path.append(name)
+        result.append((pk, Topic.separator.join(path[1:])))
+    return result
+
+def _full_name(parent, name):
+    if parent is None:
+        return name
+    return _join(parent.full_name(), name)
+
+def _record_subtree(root, old_name, new_name):
+    names = _subtree_names(root)
+    TopicRedirect.objects.record(
+            [(_join(old_name, rel), pk) for pk, rel in names],
+            [_join(new_name, rel) for _, rel in names])
+
+def _snapshot(node, name, parent_id):
+    # pylint: disable-msg=W0212
+    node._acacia_redirect_state = (name, parent_id)
+
+def handle_post_init(sender, instance, **kwargs):
+    """
+    Remembers the name and parent of each topic as it is loaded, so that a
+    later save can tell if it has been renamed or moved (by which time, mptt
+    may already have updated the parent in the database).
+    """
+    _snapshot(instance, instance.name, instance.parent_id)
+
+def handle_pre_save(sender, instance, raw=False, **kwargs):
+    """
+    Records redirects for a topic subtree that is being renamed or moved by
+    changing the name or parent of its root node and saving it.
+    """
+    state = getattr(instance, "_acacia_redirect_state", None)
+    if raw or instance.pk is None or state is None:
+        return
+    old_name, old_parent_id = state
+    if (old_name, old_parent_id) == (instance.name, instance.parent_id):
+        return
+    if old_parent_id is None:
+        old_parent = None
+    else:
+        old_parent = Topic.objects.get(pk=old_parent_id)
+    _record_subtree(instance, _full_name(old_parent, old_name),
+            _full_name(instance.parent, instance.name))
+
+def handle_post_save(sender, instance, **kwargs):
+    _snapshot(instance, instance.name, instance.parent_id)
+
+def handle_pre_move(sender, moving, **kwargs):
+    """
+    Records redirects for subtrees moved by AbstractTopic.merge_to().
+    """
+    for node, parent in moving:
+        if not isinstance(node, Topic):
+            continue
+        _record_subtree(node, node.full_name(), _full_name(parent, node.name))
+        if parent is None:
+            _snapshot(node, node.name, None)
+        else:
+            _snapshot(node, node.name, parent.id)
+
+def handle_pre_merge(sender, merge_pairs, **kwargs):
+    """
+    Records a redirect from the name of each node that is about to be merged
+    away to its replacement and repoints any existing redirects, so that none
+    of them are lost when the merged nodes are deleted.
+    """
+    if not isinstance(sender, Topic):
+        return
+    old_names = {}
+    prefix = sender.full_name()
+    for pk, rel in _subtree_names(sender):
+        old_names[pk] = _join(prefix, rel)
+    for old_id, new_id in merge_pairs:
+        TopicRedirect.objects.repoint(old_id, new_id)
+    TopicRedirect.objects.record([(old_names[old_id], new_id)
+            for old_id, new_id in merge_pairs])
+
+model_signals.post_init.connect(handle_post_init, sender=Topic)
+model_signals.pre_save.connect(handle_pre_save, sender=Topic)
+model_signals.post_save.connect(handle_post_save, sender=Topic)
+# Acacia's own signals are sent with a Topic instance as the sender, so they
+# can't be filtered by class here.
+signals.pre_move.connect(handle_pre_move)
+signals.pre_merge.connect(handle_pre_merge)
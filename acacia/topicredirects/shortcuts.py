@@ -0,0 +1,27 @@
+"""
+Helpers for views that look up topics by full names that may be out of date.
+"""
+
+from acacia.models import Topic
+from acacia.topicredirects.models import TopicRedirect
+
+
+def get_topic_or_redirect(full_name):
+    """
+    Returns a pair: the topic with the given full name and a boolean flag that
+    is True if 'full_name' is an old name for that topic (in which case the
+    view will normally want to redirect to the current name).
+
+    Existing topics always take precedence over redirects.
+
+    Raises Topic.DoesNotExist if 'full_name' is neither the current nor an old
+    name of any topic.
+    """
+    try:
+        return Topic.objects.get_by_full_name(full_name), False
+    except Topic.DoesNotExist:
+        pass
+    try:
+        return TopicRedirect.objects.resolve(full_name), True
+    except TopicRedirect.DoesNotExist:
+        raise Topic.DoesNotExist
@@ -0,0 +1,193 @@
+"""
+Helpers for views addressed by topic full names.
+
+A URL pattern made by topic_pattern() captures a full name, which the
+topic_view() decorator resolves to a topic before calling the view. Each
+resolved name is cached (in Django's cache, so it is shared by all the
+processes) as the primary keys of the topic and its ancestors. A later request
+for the same name then costs one query, which reads the whole path and checks
+it against the name, so an entry made stale by a rename or move is never
+trusted. The topic's ancestor_path() and full_name() are filled in from the
+same query.
+
+Names that don't exist are only cached while tree versions are being tracked
+(see acacia.snapshot), since the cache entry is otherwise never invalidated
+when the topic is created.
+
+topic_urls() goes the other way, building the URLs of many topics with one
+query for all their ancestors and a single reverse() call.
+"""
+
+from django import http
+from django.conf import settings
+from django.conf.urls.defaults import url
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.utils.encoding import iri_to_uri
+from django.utils.functional import wraps
+from django.utils.hashcompat import md5_constructor
+
+from acacia import snapshot
+from acacia.instrumentation import instrumented
+from acacia.models import Topic
+
+__all__ = ["topic_pattern", "resolve", "topic_view", "topic_urls"]
+
+CACHE_TIMEOUT = getattr(settings, "ACACIA_URL_CACHE_TIMEOUT", 3600)
+
+# Cached in place of a list of primary keys for names that don't exist.
+NO_TOPIC = ()
+
+# Stands in for the full name when reversing a URL pattern once for many
+# topics.
+PLACEHOLDER = "acacia-topic-placeholder"
+
+
+def topic_pattern(prefix, view, kwargs=None, name=None):
+    """
+    Returns a URL pattern for 'view' that matches 'prefix' (a regular
+    expression, without the leading "^") followed by a full name and a slash,
+    passing the full name as the "full_name" keyword argument.
+    """
+    return url(r"^%s(?P<full_name>.+?)/$" % prefix, view, kwargs, name)
+
+def _cache_key(model, full_name):
+    opts = model._meta
+    if snapshot.is_enabled():
+        version = snapshot.tree_version(model)
+    else:
+        version = ""
+    return "acacia.url.%s.%s.%s.%s" % (opts.app_label, opts.object_name,
+            version, md5_constructor(full_name.encode("utf-8")).hexdigest())
+
+def _pieces(model, full_name):
+    return [model.lookup_key(piece) for piece in full_name.split(
+            model.separator) if piece]
+
+def _check_path(model, pieces, path):
+    """
+    Returns True if the topics in 'path', ordered from the root, have the
+    names in 'pieces' and each is the parent of the next.
+    """
+    if len(path) != len(pieces):
+        return False
+    parent_id = None
+    for node, piece in zip(path, pieces):
+        if (node.parent_id != parent_id or
+                getattr(node, model.lookup_field) != piece):
+            return False
+        parent_id = node.pk
+    return True
+
+@instrumented("resolve_url", sender=lambda full_name, model=Topic: model)
+def resolve(full_name, model=Topic):
+    """
+    Returns the topic of type 'model' (default: Topic) with the given full
+    name, using and filling in the shared cache. The topic's ancestor path is
+    loaded with it.
+
+    Raises model.DoesNotExist if there is no such topic.
+    """
+    # pylint: disable-msg=W0212
+    pieces = _pieces(model, full_name)
+    if not pieces:
+        raise model.DoesNotExist
+    key = _cache_key(model, model.separator.join(pieces))
+    pks = cache.get(key)
+    if pks == NO_TOPIC:
+        raise model.DoesNotExist
+    if pks is not None:
+        nodes = dict([(node.pk, node) for node in
+                model._default_manager.filter(pk__in=pks)])
+        path = [nodes[pk] for pk in pks if pk in nodes]
+        if _check_path(model, pieces, path):
+            topic = path[-1]
+            topic._set_ancestor_path(path)
+            return topic
+    try:
+        topic = model._default_manager.get_by_full_name(full_name)
+    except model.DoesNotExist:
+        if snapshot.is_enabled():
+            cache.set(key, NO_TOPIC, CACHE_TIMEOUT)
+        raise
+    cache.set(key, [node.pk for node in topic.ancestor_path()],
+            CACHE_TIMEOUT)
+    return topic
+
+def _redirect_target(full_name, model):
+    """
+    Returns the topic that used to be called 'full_name', if the redirects
+    application is installed, or None.
+    """
+    if (model is not Topic or
+            "acacia.topicredirects" not in settings.INSTALLED_APPS):
+        return None
+    from acacia.topicredirects.models import TopicRedirect
+    try:
+        return TopicRedirect.objects.resolve(full_name)
+    except TopicRedirect.DoesNotExist:
+        return None
+
+def _moved(request, old_name, topic):
+    path = request.path
+    start = path.rfind(old_name)
+    new_path = u"%s%s%s" % (path[:start], topic.full_name(),
+            path[start + len(old_name):])
+    query = request.META.get("QUERY_STRING", "")
+    if query:
+        new_path = u"%s?%s" % (new_path, query)
+    return http.HttpResponsePermanentRedirect(iri_to_uri(new_path))
+
+def topic_view(model=Topic, redirect=True):
+    """
+    Returns a decorator for views called with a "full_name" keyword argument
+    (as from topic_pattern()), which calls the view with the resolved topic of
+    type 'model' as the "topic" argument instead.
+
+    Names that don't exist raise Http404. If 'redirect' is True, requests
+    using a name that isn't in its canonical form (with repeated separators,
+    say) and, when the acacia.topicredirects application is installed, old
+    names of topics are permanently redirected to the current name.
+    """
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            full_name = kwargs.pop("full_name")
+            try:
+                topic = resolve(full_name, model)
+            except model.DoesNotExist:
+                topic = redirect and _redirect_target(full_name, model)
+                if not topic:
+                    raise http.Http404("No topic called '%s'." % full_name)
+                return _moved(request, full_name, topic)
+            if redirect and full_name != topic.full_name():
+                return _moved(request, full_name, topic)
+            kwargs["topic"] = topic
+            return view(request, *args, **kwargs)
+        return wraps(view)(wrapper)
+    return decorator
+
+def topic_urls(viewname, topics, args=None, kwargs=None, urlconf=None):
+    """
+    Returns a list of the URLs for the topics in 'topics', as given by
+    reverse() for the named view with each topic's full name as the
+    "full_name" keyword argument (and any other 'args' and 'kwargs').
+
+    The topics' ancestors are loaded with one query (see
+    TopicManager.prefetch_ancestors()) and the URL pattern is only reversed
+    once, so this is much cheaper than reversing each URL separately.
+    """
+    topics = list(topics)
+    if not topics:
+        return []
+    return _topic_urls(topics[0].__class__, viewname, topics, args, kwargs,
+            urlconf)
+
+@instrumented("topic_urls", sender=lambda model, *args: model)
+def _topic_urls(model, viewname, topics, args, kwargs, urlconf):
+    model._default_manager.prefetch_ancestors(topics)
+    kwargs = dict(kwargs or {})
+    kwargs["full_name"] = PLACEHOLDER
+    start, end = reverse(viewname, urlconf, args, kwargs).split(PLACEHOLDER,
+            1)
+    return [u"%s%s%s" % (start, iri_to_uri(topic.full_name()), end)
+            for topic in topics]
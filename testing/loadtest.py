@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+"""
+A load test for Acacia, run against a file-backed SQLite database, with only
+the mptt and acacia applications installed.
+
+Reader threads look topics up with get_by_full_name() while writer threads
+create topics with get_or_create_by_full_name() and move subtrees around with
+merge_to(), which is the mix that rebalances the mptt trees under the readers.
+A checker thread runs the integrity checks every so often. Each thread uses its
+own random generator, seeded from --seed, so the sequence of operations each
+thread attempts is reproducible (although their interleaving isn't).
+
+For each operation the script reports the throughput, the median and 99th
+percentile latencies, how often the database was locked (and for how long in
+total) and the number of errors and correctness violations. SQLite's busy
+timeout is 0 by default, so every lock is reported straight away and retried
+here, which is what the lock figures count. A violation is a
+lookup or creation that returns a topic with a different full name, a merge
+that leaves other than one child with the merged name, or a problem found by
+acacia.integrity.verify() (broken nesting or duplicate names). The final state
+of the database is checked once all the threads have stopped. The exit status
+is 1 if there were any violations or any thread died with an exception.
+
+Run "loadtest.py --help" for the options.
+"""
+
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.core import management
+
+# Kept small, so that merges regularly find overlapping subtrees.
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon"]
+
+# Operations whose database was locked are retried this many times before
+# giving up and counting an error.
+MAX_RETRIES = 50
+
+
+class Stats(object):
+    """
+    The figures for one operation, as gathered by a single thread.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.lock_waits = 0
+        self.lock_time = 0.0
+        self.violations = 0
+
+    def error(self, exc):
+        name = exc.__class__.__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def add(self, other):
+        self.latencies.extend(other.latencies)
+        for name, count in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + count
+        self.lock_waits += other.lock_waits
+        self.lock_time += other.lock_time
+        self.violations += other.violations
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at the given fraction of the way through the sorted
+    'values', or None if there aren't any.
+    """
+    if not values:
+        return None
+    return values[int(round(fraction * (len(values) - 1)))]
+
+def random_name(rng, options, max_depth=3):
+    pieces = ["r%d" % rng.randrange(options.roots)]
+    for _ in range(rng.randint(1, max_depth)):
+        pieces.append(rng.choice(WORDS))
+    return "/".join(pieces)
+
+
+def is_lock_error(exc):
+    """
+    Returns True if 'exc' is SQLite reporting that the database is locked,
+    whether wrapped by Django (from a query) or not (from a commit).
+    """
+    from django.db import DatabaseError
+    from django.db.backends.sqlite3.base import Database
+    if not isinstance(exc, (DatabaseError, Database.OperationalError)):
+        return False
+    message = str(exc)
+    return "locked" in message or "busy" in message
+
+
+class Worker(threading.Thread):
+    """
+    Runs randomly chosen operations until 'stop' is set, keeping a Stats
+    instance for each operation. An exception escaping an operation stops
+    the thread and is kept in 'failure'.
+    """
+    def __init__(self, number, options, stop):
+        super(Worker, self).__init__(name="worker-%d" % number)
+        self.options = options
+        self.stop = stop
+        self.rng = random.Random(options.seed + number)
+        self.stats = {}
+        self.failure = None
+
+    def run(self):
+        from django import db
+        try:
+            try:
+                while not self.stop.isSet():
+                    self.step()
+            except Exception:
+                self.failure = traceback.format_exc()
+        finally:
+            db.connection.close()
+
+    def step(self):
+        """
+        Runs one operation. Defined by each kind of worker.
+        """
+        raise NotImplementedError
+
+    def call(self, operation, func, *args):
+        """
+        Calls func(*args), retrying while the database is locked, and counts
+        any lock waits and errors against 'operation'. Returns a pair: whether
+        the call succeeded and its result.
+        """
+        from django.db import transaction
+        stats = self.stats.setdefault(operation, Stats())
+        for attempt in range(MAX_RETRIES + 1):
+            attempt_start = time.time()
+            try:
+                return True, func(*args)
+            except Exception:
+                exc = sys.exc_info()[1]
+                transaction.rollback_unless_managed()
+                if not is_lock_error(exc) or attempt == MAX_RETRIES:
+                    stats.error(exc)
+                    return False, None
+                stats.lock_waits += 1
+                time.sleep(self.rng.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+                stats.lock_time += time.time() - attempt_start
+
+    def timed(self, operation, func, *args):
+        """
+        As call(), also recording the time taken (including any lock waits)
+        if the call succeeds.
+        """
+        start = time.time()
+        ok, result = self.call(operation, func, *args)
+        if ok:
+            self.stats[operation].latencies.append(time.time() - start)
+        return ok, result
+
+    def violation(self, operation):
+        self.stats[operation].violations += 1
+
+    def check_name(self, operation, topic, name):
+        """
+        Counts a violation if 'topic' doesn't have the full name 'name' and a
+        fresh lookup of 'name' still returns it. (A writer may have moved the
+        topic since it was returned, which isn't a violation.)
+        """
+        ok, full_name = self.call(operation, topic.full_name)
+        if not ok or full_name == name:
+            return
+        ok, again = self.call(operation, lookup, name)
+        if not ok or again is None or again.pk != topic.pk:
+            return
+        ok, full_name = self.call(operation, again.full_name)
+        if ok and full_name != name:
+            self.violation(operation)
+
+
+def lookup(name):
+    """
+    Returns the topic called 'name', or None if there isn't one. (Names come
+    and go as subtrees are merged, so a miss is fine.)
+    """
+    from acacia.models import Topic
+    try:
+        return Topic.objects.get_by_full_name(name)
+    except Topic.DoesNotExist:
+        return None
+
+
+class Reader(Worker):
+    def step(self):
+        name = random_name(self.rng, self.options)
+        ok, topic = self.timed("get_by_full_name", lookup, name)
+        if ok and topic is not None:
+            self.check_name("get_by_full_name", topic, name)
+
+
+class Writer(Worker):
+    def step(self):
+        if self.rng.random() < self.options.merge_fraction:
+            self.merge()
+        else:
+            self.create()
+
+    def create(self):
+        from acacia.models import Topic
+        name = random_name(self.rng, self.options)
+        ok, result = self.timed("get_or_create_by_full_name",
+                Topic.objects.get_or_create_by_full_name, name)
+        if ok:
+            self.check_name("get_or_create_by_full_name", result[0], name)
+
+    def merge(self):
+        from acacia.models import Topic
+        # Finding the nodes isn't part of the timed operation.
+        ok, node = self.call("merge_to", lookup, random_name(self.rng,
+                self.options))
+        if not ok or node is None:
+            return
+        ok, target = self.call("merge_to", lookup, random_name(self.rng,
+                self.options, 1))
+        if not ok or target is None:
+            return
+        if (target.pk == node.parent_id or (target.tree_id == node.tree_id
+                and node.lft <= target.lft <= node.rght)):
+            return
+        if not self.timed("merge_to", node.merge_to, target)[0]:
+            return
+        ok, count = self.call("merge_to", Topic.objects.filter(parent=target,
+                name=node.name).count)
+        if ok and count != 1:
+            self.violation("merge_to")
+
+
+class Checker(Worker):
+    """
+    Runs the integrity checks every 'check_interval' seconds.
+    """
+    def step(self):
+        from acacia import integrity
+        from acacia.models import Topic
+        ok, problems = self.timed("verify", lambda: list(integrity.verify(
+                Topic)))
+        if ok:
+            self.stats["verify"].violations += len(problems)
+        self.stop.wait(self.options.check_interval)
+
+
+def seed(options):
+    from acacia.models import Topic
+    rng = random.Random(options.seed)
+    for _ in range(options.topics):
+        Topic.objects.get_or_create_by_full_name(random_name(rng, options))
+
+def report(stats, elapsed, out=sys.stdout):
+    out.write("%-28s %8s %9s %9s %9s %7s %9s %7s %10s\n" % ("operation",
+            "calls", "ops/s", "p50 ms", "p99 ms", "locks", "lock ms",
+            "errors", "violations"))
+    for operation in sorted(stats):
+        entry = stats[operation]
+        latencies = sorted(entry.latencies)
+        figures = []
+        for fraction in (0.5, 0.99):
+            value = percentile(latencies, fraction)
+            if value is None:
+                figures.append("-")
+            else:
+                figures.append("%.2f" % (value * 1000))
+        out.write("%-28s %8d %9.1f %9s %9s %7d %9.1f %7d %10d\n" % (operation,
+                len(latencies), len(latencies) / elapsed, figures[0],
+                figures[1], entry.lock_waits, entry.lock_time * 1000,
+                sum(entry.errors.values()), entry.violations))
+    for operation in sorted(stats):
+        for name, count in sorted(stats[operation].errors.items()):
+            out.write("  %s: %d x %s\n" % (operation, count, name))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--readers", type="int", default=4,
+            help="Number of reader threads (default 4).")
+    parser.add_option("--writers", type="int", default=2,
+            help="Number of writer threads (default 2).")
+    parser.add_option("--merge-fraction", type="float", default=0.25,
+            help="Fraction of writes that are merges (default 0.25).")
+    parser.add_option("--duration", type="float", default=10,
+            help="Seconds to run for (default 10).")
+    parser.add_option("--roots", type="int", default=5,
+            help="Number of root topics names are made from (default 5).")
+    parser.add_option("--topics", type="int", default=200,
+            help="Number of topic names to create first (default 200).")
+    parser.add_option("--seed", type="int", default=0,
+            help="Random seed (default 0).")
+    parser.add_option("--check-interval", type="float", default=1,
+            help="Seconds between integrity checks while running (default "
+            "1; 0 to only check at the end).")
+    parser.add_option("--busy-timeout", type="float", default=0,
+            help="Seconds SQLite waits for a lock itself before an operation "
+            "is retried (default 0, so that all lock waits are counted).")
+    parser.add_option("--database", default=None,
+            help="SQLite database file (default: a temporary file, removed "
+            "afterwards). Any existing file is replaced.")
+    if argv is None:
+        argv = sys.argv
+    options = parser.parse_args(argv[1:])[0]
+
+    pkg_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, pkg_dir)
+
+    temp_dir = None
+    path = options.database
+    if path is None:
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, "acacia-load.db")
+    elif os.path.exists(path):
+        os.remove(path)
+
+    # Only the applications under test, so that no other application's
+    # signal handlers (topicredirects, say) add to the timings.
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": path,
+                "OPTIONS": {"timeout": options.busy_timeout},
+            },
+        },
+        INSTALLED_APPS=("mptt", "acacia"),
+    )
+
+    try:
+        from django import db
+        from acacia import integrity
+        from acacia.models import Topic
+
+        management.call_command("syncdb", verbosity=0, interactive=False)
+        seed(options)
+        db.connection.close()
+
+        stop = threading.Event()
+        workers = [Reader(i, options, stop) for i in range(options.readers)]
+        workers.extend([Writer(options.readers + i, options, stop)
+                for i in range(options.writers)])
+        if options.check_interval > 0:
+            workers.append(Checker(len(workers), options, stop))
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        try:
+            time.sleep(options.duration)
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        elapsed = time.time() - start
+
+        stats = {}
+        for worker in workers:
+            for operation, entry in worker.stats.items():
+                stats.setdefault(operation, Stats()).add(entry)
+        problems = list(integrity.verify(Topic))
+        report(stats, elapsed)
+        sys.stdout.write("\n%d topics after %.1fs; final integrity check: "
+                "%d problems\n" % (Topic.objects.count(), elapsed,
+                len(problems)))
+        for problem in problems[:20]:
+            sys.stdout.write("  tree %s, node %s: %s\n" % problem)
+        failures = [worker for worker in workers if worker.failure]
+        for worker in failures:
+            sys.stdout.write("\n%s died:\n%s" % (worker.getName(),
+                    worker.failure))
+        db.connection.close()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    if (problems or failures or
+            [entry for entry in stats.values() if entry.violations]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
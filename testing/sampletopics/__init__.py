@@ -0,0 +1,4 @@
+"""
+Topic models used only by the tests, for features that the default Topic
+model doesn't use.
+"""
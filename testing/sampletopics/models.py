@@ -0,0 +1,15 @@
+import mptt
+
+from acacia.models import CollatedTopic, NormalisedTopic
+
+
+class SortedTopic(CollatedTopic):
+    pass
+
+mptt.register(SortedTopic, order_insertion_by=["sort_key", "name"])
+
+
+class FoldedTopic(NormalisedTopic):
+    pass
+
+mptt.register(FoldedTopic, order_insertion_by=["name"])
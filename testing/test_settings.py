@@ -2,11 +2,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'acacia'
+    },
+    # Only used by the tests that check queries go to the right database.
+    'other': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'acacia_other'
     }
 }
 
 INSTALLED_APPS = (
     'mptt',
     'acacia',
+    'acacia.topicredirects',
+    'sampletopics',
 )
 
+
+ROOT_URLCONF = 'acacia.tests.test_views'